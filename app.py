@@ -1,99 +1,939 @@
-from flask import Flask, render_template_string, request, session, redirect, url_for
-import matplotlib
-matplotlib.use('Agg')  # Use Agg backend for Matplotlib (no GUI)
-import matplotlib.pyplot as plt
+from flask import Flask, Response, g, jsonify, make_response, render_template, request, session, redirect, url_for
+from flask.sessions import SecureCookieSessionInterface
+from werkzeug.http import is_resource_modified
 import pandas as pd
-import io
-import base64
 import os
-import numpy as np
 import csv
 import uuid
+import hashlib
+import re
+import gzip
 import threading
 import logging
+from storage import open_storage, temp_path_for
+from votelog import ColumnarVoteLog, tally as tally_vote_log
+from charts import ChartRenderer, ChartRenderUnavailable
+from metrics import Registry, TimedLock
+from flask.signals import before_render_template, template_rendered
+import time
+import atexit
+import json
+import queue
+from collections import namedtuple, OrderedDict
+from concurrent.futures import Future
+from datetime import datetime, timezone
+
+try:
+    import brotli  # Optional; responses fall back to gzip without it
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'  # Set a secret key for session management
 
+# Static files are linked with ?v=<hash of their contents>, so browsers may
+# keep them for a year and still fetch a new copy after a deploy
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 365 * 24 * 3600
+
+def static_asset_version():
+    digest = hashlib.sha1()
+    for name in sorted(os.listdir(app.static_folder)):
+        with open(os.path.join(app.static_folder, name), 'rb') as f:
+            digest.update(name.encode('utf-8'))
+            digest.update(f.read())
+    return digest.hexdigest()[:10]
+
+app.jinja_env.globals['asset_version'] = static_asset_version()
+
+# Compile the page templates once at import; Jinja keeps them in its cache
+# and, outside debug mode, never checks the files again
+PAGE_TEMPLATES = ('login.html', 'users.html', 'wait.html', 'survey.html', 'chart.html', 'logout.html')
+for template_name in PAGE_TEMPLATES:
+    app.jinja_env.get_template(template_name)
+
 # Configure logging to print to the console
 logging.basicConfig(level=logging.INFO)  # Log messages at INFO level
 
-# Global flag to track if session has been cleared
-session_cleared = False
+# Changes on every start so cache validators from a previous run never match
+BOOT_ID = uuid.uuid4().hex[:8]
+
+# Sessions from before this start are cleared on their next request. serve.py
+# sets POLL_SESSION_EPOCH once for all of its worker processes.
+SESSION_EPOCH = os.environ.get('POLL_SESSION_EPOCH') or BOOT_ID
+
+# Set by serve.py when several worker processes share the same storage. Each
+# process then picks up votes, users and the active id written by the others
+# through SharedStateSync instead of only counting its own requests.
+SHARED_STATE = os.environ.get('POLL_SHARED_STATE') == '1'
 
 # Function to initialize active.csv and clear session.csv
+# (or the same state in the configured storage backend) in every room
 def initialize_files():
-    global session_cleared  # Use the global variable
-        
-    # Set 0 in active.csv
-    with open('active.csv', 'w') as active_file:
-        active_file.write('0')  # Writing 0 to the active.csv file
-    
-    # Clear the contents of session.csv
-    if os.path.exists('session.csv'):
-        with open('session.csv', 'w') as session_file:
-            session_file.truncate(0)  # Clearing the file content
-            
-    # Clear the contents of user.csv
-    if os.path.exists('users.csv'):
-        with open('users.csv', 'w') as session_file:
-            session_file.truncate(0)  # Clearing the file content
-
-    normalize_csv_with_comma('data.csv')
-
-    # Mark session as not cleared yet
-    session_cleared = False
-
-# Flask route to initialize session storage **only once**
+    for room in rooms.all():
+        room.initialize()
+
+# Timings exposed on /metrics (per process)
+metrics = Registry()
+request_duration = metrics.histogram(
+    'poll_request_duration_seconds', 'Time spent handling a request.', labels=('endpoint', 'method'))
+template_render_duration = metrics.histogram(
+    'poll_template_render_seconds', 'Time spent rendering a page template.', labels=('template',))
+lock_wait_duration = metrics.histogram(
+    'poll_lock_wait_seconds', 'Time spent waiting to acquire a CSV lock.', labels=('lock',))
+lock_hold_duration = metrics.histogram(
+    'poll_lock_hold_seconds', 'Time a CSV lock was held.', labels=('lock',))
+chart_render_duration = metrics.histogram(
+    'poll_chart_render_seconds', 'Time spent drawing a chart PNG with Matplotlib.')
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_duration(response):
+    start = g.get('request_start')
+    if start is not None:
+        endpoint = request.url_rule.rule if request.url_rule else '<unmatched>'
+        request_duration.observe(time.perf_counter() - start, endpoint, request.method)
+    return response
+
+def start_template_timer(sender, template, context, **extra):
+    g.template_start = time.perf_counter()
+
+def record_template_duration(sender, template, context, **extra):
+    start = g.pop('template_start', None)
+    if start is not None:
+        template_render_duration.observe(time.perf_counter() - start, template.name or '<string>')
+
+before_render_template.connect(start_template_timer, app)
+template_rendered.connect(record_template_duration, app)
+
+# Flask route to clear sessions left over from before this start
 @app.before_request
 def clear_session():
-    global session_cleared  # Use the global variable
-    
-    if not session_cleared:
-        session.clear()
-        session.modified = True
-        logging.info("session cleared")
-        session_cleared = True  # Ensure it runs only once
-
-csv_lock_data = threading.Lock()
-csv_lock_session = threading.Lock()
-csv_lock_user = threading.Lock()
-csv_lock_active = threading.Lock()
-
-def normalize_csv_with_comma(file_path):
-    # Read the CSV file
-    with open(file_path, 'r', newline='', encoding='utf-8') as file:
-        reader = csv.reader(file)
-        lines = list(reader)
-
-    # Find the maximum number of columns
-    max_columns = max(len(row) for row in lines if row)  # Avoid empty rows
-
-    # Normalize each row to have the same number of columns
-    normalized_lines = []
-    for row in lines:
-        if row:  # Skip empty lines
-            # Append commas to rows with fewer columns
-            while len(row) < max_columns:
-                row.append('')  # Append empty string, this will result in a comma when written
-            normalized_lines.append(row)
-
-    # Write the normalized CSV back to the file, removing any empty lines
-    with open(file_path, 'w', newline='', encoding='utf-8') as file:
-        writer = csv.writer(file)
-        for row in normalized_lines:
-            if row:  # Skip entirely empty rows
-                writer.writerow(row)
-                
-def read_csv_data():
-    # Read CSV while handling uneven columns 
-    with open('data.csv', 'r', encoding='utf-8') as file:
-        lines = [line.strip().split(',') for line in file.readlines()]
-    return lines
+    start_worker()  # No-op after the first request in this process
+
+    if session.get('epoch') != SESSION_EPOCH:
+        if session:
+            session.clear()
+            logging.info("session cleared")
+        session['epoch'] = SESSION_EPOCH
+
+def reset_session():
+    # Clear all session data but keep it marked as belonging to this start
+    session.clear()
+    session['epoch'] = SESSION_EPOCH
+
+# Where each room keeps votes, users and the active id: 'csv' (default) uses
+# session.csv, users.csv and active.csv, 'sqlite' a WAL-mode database (POLL_DB
+# for the default room). data.csv always stays the question bank.
+POLL_STORAGE = os.environ.get('POLL_STORAGE', 'csv')
+POLL_DB = os.environ.get('POLL_DB', 'poll.db')
+
+class VoteTally:
+    # Per-question, per-option vote counters kept in memory so /chart does not
+    # have to re-scan the vote log on every refresh. Rebuilt from the log at
+    # startup and updated by survey() as each vote comes in. Alongside the
+    # counts it indexes who gave each answer, in submission order, for the
+    # hand-raise list on "Do you have any question?", and which answer each
+    # session gave to each question, so a resubmitted vote is caught in O(1).
+    # duplicate_policy decides what a second vote from the same session does:
+    #   reject        the first answer stands; later ones are not stored
+    #   replace       a different answer replaces the earlier one and is
+    #                 stored; resubmitting the same answer is dropped
+    #   count-latest  like replace, but every submission is stored, so the
+    #                 log keeps the full history
+    def __init__(self, duplicate_policy='reject'):
+        if duplicate_policy not in DUPLICATE_POLICIES:
+            raise ValueError(f"Unknown duplicate vote policy: {duplicate_policy}")
+        self.duplicate_policy = duplicate_policy
+        self.lock = threading.Lock()
+        self.counts = {}  # question id -> {answer: number of votes}
+        # question id -> {normalized answer: {session id: name}}; dicts keep
+        # insertion order, and a replaced vote is removed by its session even
+        # when two participants share a name
+        self.names = {}
+        self.ballots = {}  # (session id, question id) -> (answer, name) that counts
+        self.versions = {}  # question id -> tally revision of its last change
+        self.revision = 0  # Bumped on every change, never reset
+        self.modified = {}  # question id -> time.time() of its last change
+        self.reset_at = time.time()
+
+    def reset(self):
+        with self.lock:
+            self.counts = {}
+            self.names = {}
+            self.ballots = {}
+            self.versions = {}
+            self.revision += 1
+            self.modified = {}
+            self.reset_at = time.time()
+
+    def rebuild(self, rows):
+        # Replay the whole vote log once; only used at startup
+        counts, names, ballots = {}, {}, {}
+        for row in rows:
+            try:
+                question_id = int(row[2])
+            except ValueError:
+                continue  # Skip rows without a valid question id
+            self._apply(counts, names, ballots, question_id, row[3], row[1], row[0])
+        self.replace(counts, names, ballots)
+
+    def replace(self, counts, names, ballots):
+        # Swap in indexes computed elsewhere (rebuild(), or votelog.tally()
+        # over the columnar log)
+        with self.lock:
+            self.revision += 1
+            self.counts = counts
+            self.names = names
+            self.ballots = ballots
+            self.versions = {question_id: self.revision for question_id in counts}
+            self.modified = {}
+            self.reset_at = time.time()
+
+    def _apply(self, counts, names, ballots, question_id, answer, name, session_id):
+        # Count one vote under the duplicate policy; False if it changes nothing
+        key = (session_id, question_id)
+        previous = ballots.get(key)
+        if previous is not None:
+            if self.duplicate_policy == 'reject' or previous[0] == answer:
+                return False
+            # Take the earlier answer back out before counting the new one
+            old_answer, old_name = previous
+            grouped = counts[question_id]
+            grouped[old_answer] -= 1
+            if not grouped[old_answer]:
+                del grouped[old_answer]
+            respondents = names[question_id]
+            label = old_answer.strip().lower()
+            del respondents[label][session_id]
+            if not respondents[label]:
+                del respondents[label]
+        grouped = counts.setdefault(question_id, {})
+        grouped[answer] = grouped.get(answer, 0) + 1
+        names.setdefault(question_id, {}).setdefault(answer.strip().lower(), {})[session_id] = name.strip()
+        ballots[key] = (answer, name)
+        return True
+
+    def accepts(self, question_id, answer, session_id):
+        # Whether record() would change the tally for this vote
+        previous = self.ballots.get((session_id, question_id))
+        return previous is None or (self.duplicate_policy != 'reject' and previous[0] != answer)
+
+    def record(self, question_id, answer, name, session_id):
+        # Count a vote; returns False for a duplicate the policy ignores
+        with self.lock:
+            if not self._apply(self.counts, self.names, self.ballots, question_id, answer, name, session_id):
+                return False
+            self.revision += 1
+            self.versions[question_id] = self.revision
+            self.modified[question_id] = time.time()
+            return True
+
+    def modified_at(self, question_id):
+        with self.lock:
+            return self.modified.get(question_id, self.reset_at)
+
+    def counts_for(self, question_id):
+        # Copy so callers can use the result without holding the lock
+        with self.lock:
+            return dict(self.counts.get(question_id, {}))
+
+    def version(self, question_id):
+        # Changes whenever the counts for question_id change; 0 means no votes
+        with self.lock:
+            return self.versions.get(question_id, 0)
+
+    def snapshot(self, question_id, answer=None):
+        # Version, last change time, counts and (for answer) respondents of
+        # one question, read together so a validator built from the version
+        # always describes exactly the data served with it
+        with self.lock:
+            respondents = None
+            if answer is not None:
+                respondents = list(self.names.get(question_id, {}).get(answer.strip().lower(), {}).values())
+            return TallySnapshot(self.versions.get(question_id, 0),
+                                 self.modified.get(question_id, self.reset_at),
+                                 dict(self.counts.get(question_id, {})), respondents)
+
+TallySnapshot = namedtuple('TallySnapshot', ['version', 'modified_at', 'counts', 'respondents'])
+
+class ActiveQuestion:
+    # The active question id, kept in memory so the request paths do not read
+    # active.csv. Reads are a plain attribute access; changes go through the
+    # lock and are written through to storage so a restart recovers them.
+    def __init__(self, storage, lock):
+        self.storage = storage
+        self.lock = lock
+        self.active_id = 0
+
+    def load(self):
+        active_id = self.storage.load_active()
+        with self.lock:
+            self.active_id = active_id
+
+    def get(self):
+        return self.active_id
+
+    def _write(self, active_id):
+        self.storage.store_active(active_id)
+
+    def store(self, active_id):
+        with self.lock:
+            self._write(active_id)
+            self.active_id = active_id
+
+    def advance(self, new_active_id):
+        # Move to new_active_id only if it is past the current id. The check
+        # and the write happen under one lock (across processes, in storage),
+        # so concurrent /activate calls can never move the pointer backwards.
+        with self.lock:
+            if new_active_id <= self.active_id:
+                return False
+            if not self.storage.advance_active(new_active_id):
+                return False  # Another worker process already moved further
+            self.active_id = new_active_id
+            return True
+
+    def observe(self, active_id):
+        # Adopt an id another worker process stored; never moves backwards
+        # unless storage was reset to 0
+        with self.lock:
+            if active_id == self.active_id or (0 < active_id < self.active_id):
+                return False
+            self.active_id = active_id
+            return True
+
+class UserRoster:
+    # In-memory list of logged-in user names, in login order and without
+    # duplicates: logging in again under the same name does not add it twice.
+    # login() appends here and queues the name for storage; /users renders
+    # from this list instead of re-reading users.csv.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = []
+        self.seen = set()
+        self.version = 0  # Bumped on every change, for /users' ETag
+        self.summary_cache = None  # (version, count, joined names)
+
+    def reset(self):
+        with self.lock:
+            self.users = []
+            self.seen = set()
+            self.version += 1
+
+    def load(self, users):
+        with self.lock:
+            self.users = []
+            self.seen = set()
+            for name in users:
+                self._add(name)
+            self.version += 1
+
+    def add(self, name):
+        # True if the name is new, False for a re-login
+        with self.lock:
+            added = self._add(name)
+            if added:
+                self.version += 1
+            return added
+
+    def _add(self, name):
+        key = name.strip()
+        if key in self.seen:
+            return False
+        self.seen.add(key)
+        self.users.append(name)
+        return True
+
+    def contains(self, name):
+        return name.strip() in self.seen
+
+    def names(self):
+        with self.lock:
+            return list(self.users)
+
+    def summary(self):
+        # User count and comma-joined names, joined once per version
+        with self.lock:
+            cached = self.summary_cache
+            if cached is None or cached[0] != self.version:
+                cached = self.summary_cache = (self.version, len(self.users), ", ".join(self.users))
+            return cached[1], cached[2]
+
+def normalize_csv_with_comma(file_path, lock):
+    # Pad every row to the width of the widest one and drop empty lines.
+    # Two streaming passes so only one row is in memory at a time: the first
+    # finds the widest row and whether anything needs changing at all, the
+    # second writes a temporary file that then replaces data.csv.
+    with lock:
+        max_columns = 0
+        widths = set()
+        has_empty_rows = False
+        with open(file_path, 'r', newline='', encoding='utf-8') as file:
+            for row in csv.reader(file):
+                if row:
+                    widths.add(len(row))
+                    max_columns = max(max_columns, len(row))
+                else:
+                    has_empty_rows = True
+
+        # Nothing to pad in an empty file, and nothing to do if every row
+        # already has the same width
+        if max_columns == 0 or (len(widths) == 1 and not has_empty_rows):
+            return
+
+        temp_path = temp_path_for(file_path)
+        with open(file_path, 'r', newline='', encoding='utf-8') as source, \
+                open(temp_path, 'w', newline='', encoding='utf-8') as target:
+            writer = csv.writer(target)
+            for row in csv.reader(source):
+                if row:  # Skip empty lines
+                    # Append empty strings, which come out as trailing commas
+                    writer.writerow(row + [''] * (max_columns - len(row)))
+        os.replace(temp_path, file_path)
+
+class Question(namedtuple('Question', ['id', 'title', 'pairs'])):
+    # One row of data.csv. id is the 1-based row number used by /survey,
+    # /chart and /activate; pairs holds the (option, stored count) columns.
+    __slots__ = ()
+
+    @property
+    def options(self):
+        # Non-empty option labels, in file order
+        return [label for label, _ in self.pairs if label]
+
+    def to_row(self):
+        row = [self.title]
+        for label, count in self.pairs:
+            row.extend([label, count])
+        return row
+
+class QuestionCatalogue:
+    # Parsed copy of data.csv so the request paths do not re-read and re-split
+    # the file each time. The file's mtime is checked at most once every
+    # check_interval seconds; reload() forces a fresh parse.
+    def __init__(self, file_path, check_interval=2.0):
+        self.file_path = file_path
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.questions = []
+        self.mtime = None
+        self.checked_at = 0.0
+        self.generation = 0  # Bumped when titles or options change
+        self.changed_at = time.time()
+
+    def _parse(self):
+        questions = []
+        with open(self.file_path, 'r', newline='', encoding='utf-8') as file:
+            # csv.reader handles the quoted commas that csv.writer produces
+            for index, row in enumerate(csv.reader(file)):
+                title = row[0] if row else ''
+                raw_data = row[1:]
+                pairs = tuple(
+                    (raw_data[i].strip(), raw_data[i + 1].strip() if i + 1 < len(raw_data) else '')
+                    for i in range(0, len(raw_data), 2)
+                )
+                questions.append(Question(index + 1, title, pairs))
+        return questions
+
+    def reload(self):
+        with self.lock:
+            self._load()
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.file_path).st_mtime_ns
+            questions = self._parse()
+        except FileNotFoundError:
+            mtime, questions = None, []
+        # The stored counts are rewritten by the snapshot; only a change in
+        # titles or options makes cached charts stale
+        if [(q.title, q.options) for q in questions] != [(q.title, q.options) for q in self.questions]:
+            self.generation += 1
+            self.changed_at = time.time()
+        self.questions = questions
+        self.mtime = mtime
+        self.checked_at = time.monotonic()
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self.mtime is not None and now - self.checked_at < self.check_interval:
+            return
+        with self.lock:
+            if self.mtime is not None and now - self.checked_at < self.check_interval:
+                return  # Another thread refreshed while we waited for the lock
+            try:
+                mtime = os.stat(self.file_path).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime is None or mtime != self.mtime:
+                self._load()
+            else:
+                self.checked_at = now
+
+    def get(self, question_id):
+        # Question for a 1-based id, or None if data.csv has no such row
+        self._refresh()
+        questions = self.questions
+        if 1 <= question_id <= len(questions):
+            return questions[question_id - 1]
+        return None
+
+    def all(self):
+        self._refresh()
+        return list(self.questions)
+
+CATALOGUE_CHECK_INTERVAL = float(os.environ.get('CATALOGUE_CHECK_INTERVAL', 2))
+
+class CountSnapshotWriter:
+    # Write-behind persistence of the vote counts into data.csv. The counts are
+    # only a convenience copy (they can always be rebuilt from session.csv), so
+    # instead of rewriting data.csv on every /chart render we flush them every
+    # interval seconds, and only when the tally has changed since the last
+    # flush. An interval of 0 turns the snapshot off entirely.
+    def __init__(self, room, interval):
+        self.room = room
+        self.interval = interval
+        self.flushed_revision = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.interval <= 0 or self.thread is not None:
+            return
+        self.flushed_revision = self.room.vote_tally.revision  # Nothing to write yet
+        self.thread = threading.Thread(target=self._run, name='count-snapshot', daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)  # Don't lose the last few votes on shutdown
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                app.logger.error(f"Error writing count snapshot: {e}")
+
+    def flush(self):
+        room = self.room
+        revision = room.vote_tally.revision
+        if revision == self.flushed_revision:
+            return False  # Counts have not changed since the last snapshot
+
+        with room.lock_data:
+            # Start from what is on disk now, not the throttled copy, so an
+            # edit made to data.csv since the last check is not overwritten
+            room.question_catalogue.reload()
+            rows = []
+            for question in room.question_catalogue.all():
+                if question.id < 2:
+                    rows.append(question.to_row())  # Header row is never charted
+                    continue
+                grouped_data = room.vote_tally.counts_for(question.id)
+                row = [question.title]
+                for label, _ in question.pairs:
+                    row.extend([label, str(grouped_data.get(label, 0))])
+                rows.append(row)
+
+            # Write to a temporary file and rename it over data.csv so readers
+            # never see a half-written file
+            temp_path = temp_path_for(room.data_path)
+            with open(temp_path, mode='w', newline='', encoding='utf-8') as file:
+                writer = csv.writer(file)
+                writer.writerows(rows)
+            os.replace(temp_path, room.data_path)
+            room.question_catalogue.reload()
+
+        self.flushed_revision = revision
+        return True
+
+COUNT_SNAPSHOT_INTERVAL = float(os.environ.get('COUNT_SNAPSHOT_INTERVAL', 5))
+
+class VoteWriter:
+    # Background writer for session.csv. survey() queues the row and returns;
+    # this thread waits up to flush_interval seconds to gather more votes and
+    # appends the whole batch with one open/write/close (a group commit).
+    # fsync_policy 'batch' fsyncs after every batch, 'none' leaves it to the
+    # OS. A flush_interval of 0 writes each vote in the request thread.
+    thread_name = 'vote-writer'
+
+    def __init__(self, storage, flush_interval, fsync_policy, batch_size=500):
+        self.storage = storage
+        self.flush_interval = flush_interval
+        self.fsync_policy = fsync_policy
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.thread = None
+
+    def start(self):
+        if self.flush_interval <= 0 or self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def submit(self, row):
+        if self.thread is None:
+            self._write([row])
+        else:
+            self.queue.put(row)
+
+    def _run(self):
+        while True:
+            rows = [self.queue.get()]  # Block until there is something to write
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    rows.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                self._write(rows)
+            except Exception as e:
+                app.logger.error(f"Error writing to {self.thread_name}: {e}")
+            finally:
+                for _ in rows:
+                    self.queue.task_done()
+
+    def _write(self, rows):
+        self.storage.append_votes(rows, fsync=self.fsync_policy == 'batch')
+
+    def flush(self, timeout=5.0):
+        # Wait for queued votes to reach the file (used at exit)
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+VOTE_FLUSH_INTERVAL = float(os.environ.get('VOTE_FLUSH_INTERVAL', 0.05))
+VOTE_FSYNC = os.environ.get('VOTE_FSYNC', 'none')
+
+# What a second vote from the same session for the same question does; see
+# VoteTally
+DUPLICATE_POLICIES = ('reject', 'replace', 'count-latest')
+VOTE_DUPLICATE_POLICY = os.environ.get('VOTE_DUPLICATE_POLICY', 'reject')
+
+# Each room keeps a compact binary copy of its vote log (votes.bin and
+# votes.json, see votelog.py) so a restart tallies from memory-mapped arrays
+# and only parses votes newer than the last compaction. 0 turns it off.
+VOTE_COLUMNAR_LOG = os.environ.get('VOTE_COLUMNAR_LOG', '1') == '1'
+
+class UserWriter(VoteWriter):
+    # Same batching, for new names on their way to users.csv
+    thread_name = 'user-writer'
+
+    def _write(self, names):
+        self.storage.append_users(names, fsync=self.fsync_policy == 'batch')
+
+class EventBroker:
+    # Fans server-sent events out to every open /events stream so pages can
+    # update when something happens instead of polling on a timer
+    def __init__(self, queue_size=100):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.queue_size = queue_size
+
+    def subscribe(self, subscriber=None):
+        # Anything with a put_nowait() that raises queue.Full when the client
+        # is behind; a plain queue for the threaded /events route
+        if subscriber is None:
+            subscriber = queue.Queue(maxsize=self.queue_size)
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, event, data):
+        message = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                pass  # Slow client; it reloads anyway once it catches up
+
+class Room:
+    # One poll: its own question bank, active question, vote log, roster and
+    # event stream, each behind this room's own locks, so requests for
+    # different rooms never wait on each other. The default room keeps the
+    # files in the working directory; room <id> keeps them in ROOMS_DIR/<id>/.
+    def __init__(self, room_id, directory):
+        self.id = room_id
+        self.data_path = os.path.join(directory, 'data.csv')
+        # Timings are labelled by file only, so /metrics does not grow with rooms
+        self.lock_data = TimedLock('data', lock_wait_duration, lock_hold_duration)
+        self.lock_session = TimedLock('session', lock_wait_duration, lock_hold_duration)
+        self.lock_user = TimedLock('user', lock_wait_duration, lock_hold_duration)
+        self.lock_active = TimedLock('active', lock_wait_duration, lock_hold_duration)
+        self.storage = open_storage(
+            POLL_STORAGE,
+            db_path=POLL_DB if room_id == DEFAULT_ROOM else os.path.join(directory, 'poll.db'),
+            synchronous='FULL' if VOTE_FSYNC == 'batch' else 'NORMAL',
+            session_path=os.path.join(directory, 'session.csv'),
+            users_path=os.path.join(directory, 'users.csv'),
+            active_path=os.path.join(directory, 'active.csv'),
+            session_lock=self.lock_session, user_lock=self.lock_user, shared=SHARED_STATE)
+        self.vote_tally = VoteTally(VOTE_DUPLICATE_POLICY)
+        self.vote_log = ColumnarVoteLog(os.path.join(directory, 'votes'), shared=SHARED_STATE)
+        self.active_question = ActiveQuestion(self.storage, self.lock_active)
+        self.user_roster = UserRoster()
+        self.question_catalogue = QuestionCatalogue(self.data_path, check_interval=CATALOGUE_CHECK_INTERVAL)
+        self.count_snapshot = CountSnapshotWriter(self, interval=COUNT_SNAPSHOT_INTERVAL)
+        self.vote_writer = VoteWriter(self.storage, VOTE_FLUSH_INTERVAL, VOTE_FSYNC)
+        self.user_writer = UserWriter(self.storage, VOTE_FLUSH_INTERVAL, VOTE_FSYNC)
+        self.event_broker = EventBroker()
+        self.shared_sync = SharedStateSync(self, interval=SHARED_SYNC_INTERVAL)
+        self.start_lock = threading.Lock()
+        self.started = False
+
+    def initialize(self):
+        # Set 0 as the active question
+        self.active_question.store(0)
+
+        # Clear the vote log and its columnar copy
+        self.storage.clear_votes()
+        self.vote_log.clear()
+
+        # The vote log is empty now, so drop the in-memory counters as well
+        self.vote_tally.reset()
+
+        # Clear the user list
+        self.storage.clear_users()
+        self.user_roster.reset()
+
+        normalize_csv_with_comma(self.data_path, self.lock_data)
+        self.question_catalogue.reload()  # Pick up the normalized file
+
+    def start(self):
+        # Load the in-memory state from storage and start the room's
+        # background threads, once per process (after the fork, for serve.py
+        # workers)
+        if self.started:
+            return
+        with self.start_lock:
+            if self.started:
+                return
+            if SHARED_STATE:
+                self.shared_sync.start()
+            else:
+                self.recover_votes()
+                self.active_question.load()
+                self.user_roster.load(self.storage.load_users())
+            self.count_snapshot.start()
+            self.vote_writer.start()
+            self.user_writer.start()
+            self.started = True
+
+    def recover_votes(self):
+        # Fill the tally from storage; returns the storage cursor it covers
+        if not VOTE_COLUMNAR_LOG:
+            rows, cursor, _ = self.storage.votes_since(0)
+            self.vote_tally.rebuild(rows)
+            return cursor
+        columns = self.vote_log.compact(self.storage)
+        self.vote_tally.replace(*tally_vote_log(columns, VOTE_DUPLICATE_POLICY))
+        return columns.cursor
+
+DEFAULT_ROOM = 'default'
+
+# Other rooms are directories here holding at least a data.csv; drop one in
+# (even while the server runs) and the poll is reachable under /r/<id>/
+ROOMS_DIR = os.environ.get('POLL_ROOMS_DIR', 'rooms')
+ROOM_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+class RoomRegistry:
+    # Rooms by id, created on first use. Lookups are a plain dict read; the
+    # lock is only taken to create a room.
+    def __init__(self, rooms_dir):
+        self.rooms_dir = rooms_dir
+        self.lock = threading.Lock()
+        self.rooms = {}
+
+    def directory_for(self, room_id):
+        if room_id == DEFAULT_ROOM:
+            return ''
+        if not ROOM_ID_PATTERN.fullmatch(room_id):
+            return None  # Also keeps ids like '..' out of the file system
+        directory = os.path.join(self.rooms_dir, room_id)
+        if not os.path.isfile(os.path.join(directory, 'data.csv')):
+            return None
+        return directory
+
+    def open(self, room_id):
+        # The room, without starting it, or None if there is no such room
+        room = self.rooms.get(room_id)
+        if room is not None:
+            return room
+        directory = self.directory_for(room_id)
+        if directory is None:
+            return None
+        with self.lock:
+            room = self.rooms.get(room_id)
+            if room is None:
+                room = self.rooms[room_id] = Room(room_id, directory)
+            return room
+
+    def get(self, room_id):
+        room = self.open(room_id)
+        if room is not None:
+            room.start()
+        return room
+
+    def all(self):
+        room_ids = [DEFAULT_ROOM]
+        if os.path.isdir(self.rooms_dir):
+            room_ids.extend(sorted(os.listdir(self.rooms_dir)))
+        return [room for room in map(self.open, room_ids) if room is not None]
+
+rooms = RoomRegistry(ROOMS_DIR)
+
+def split_room_path(path):
+    # (room id, prefix, path inside the room) for /r/<id>/..., or
+    # (None, '', path) for the default room
+    if path.startswith('/r/'):
+        room_id, _, rest = path[3:].partition('/')
+        return room_id, '/r/' + room_id, '/' + rest
+    return None, '', path
+
+def session_cookie_name(base_name, room_id):
+    return f"{base_name}-{room_id}" if room_id else base_name
+
+class RoomDispatcher:
+    # WSGI middleware for /r/<id>/...: moves the prefix into SCRIPT_NAME, so
+    # every route and url_for() work unchanged inside a room, and records the
+    # room id for load_room(). Any other path is the default room.
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        room_id, prefix, path = split_room_path(environ.get('PATH_INFO', ''))
+        if room_id is not None:
+            environ['poll.room'] = room_id
+            environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + prefix
+            environ['PATH_INFO'] = path
+        return self.wsgi_app(environ, start_response)
+
+app.wsgi_app = RoomDispatcher(app.wsgi_app)
+
+class RoomSessionInterface(SecureCookieSessionInterface):
+    # One session cookie per room, so a browser can take part in two polls
+    def get_cookie_name(self, app):
+        return session_cookie_name(super().get_cookie_name(app), request.environ.get('poll.room'))
+
+app.session_interface = RoomSessionInterface()
+
+@app.before_request
+def load_room():
+    room = rooms.get(request.environ.get('poll.room', DEFAULT_ROOM))
+    if room is None:
+        return "Unknown room", 404
+    g.room = room
+
+# Text responses at least this large are compressed for clients that accept it
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+COMPRESSIBLE_TYPES = {'text/html', 'text/plain', 'application/json'}
+AVAILABLE_ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+def preferred_encoding():
+    # Best encoding both sides support, or None to send the body as is
+    for encoding in AVAILABLE_ENCODINGS:
+        if request.accept_encodings[encoding]:
+            return encoding
+    return None
+
+def encode_body(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, 6)
+
+@app.after_request
+def compress_response(response):
+    # Streams (/events), files and bodies that are already encoded (the
+    # pre-rendered pages) pass through untouched
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = preferred_encoding()
+    if encoding is None:
+        return response
+    response.set_data(encode_body(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f"{etag}-{encoding}")  # Different bytes, different strong validator
+    return response
+
+def versioned_page(version, render):
+    # A page fully determined by `version` (a string built from cheap state
+    # counters): a browser already holding it gets a 304 before anything is
+    # rendered. The ETag is weak so it also covers the compressed copies.
+    etag = hashlib.sha1(f"{BOOT_ID}-{request.script_root}-{version}".encode('utf-8')).hexdigest()[:16]
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = make_response(render())
+    response.set_etag(etag, weak=True)
+    response.cache_control.no_cache = True  # Always revalidate; a 304 is cheap
+    return response
+
+class PrerenderedPage:
+    # A page whose HTML depends on nothing but `key` (the wait page only on
+    # the active id, /logout on nothing). Each variant is rendered once into
+    # bytes, plus compressed copies, and later requests just send a buffer.
+    # Variants are kept per room, as their links include the room's prefix.
+    def __init__(self, template_name, key_name=None, max_variants=64):
+        self.template_name = template_name
+        self.key_name = key_name
+        self.max_variants = max_variants
+        self.lock = threading.Lock()
+        self.variants = {}  # (room prefix, key) -> (etag, {encoding or None: body})
+
+    def variant(self, key=None):
+        variant = self.variants.get((request.script_root, key))
+        if variant is None:
+            context = {self.key_name: key} if self.key_name else {}
+            body = render_template(self.template_name, **context).encode('utf-8')
+            bodies = {None: body}
+            for encoding in AVAILABLE_ENCODINGS:
+                bodies[encoding] = encode_body(body, encoding)
+            variant = (hashlib.sha1(body).hexdigest()[:16], bodies)
+            with self.lock:
+                if len(self.variants) >= self.max_variants:
+                    self.variants.clear()  # Only reached with many rooms or wild ids
+                self.variants[(request.script_root, key)] = variant
+        return variant
+
+    def response(self, key=None):
+        etag, bodies = self.variant(key)
+        encoding = preferred_encoding()
+        response = Response(bodies[encoding], mimetype='text/html')
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+            etag += '-' + encoding  # Different bytes, so a different strong validator
+        response.vary.add('Accept-Encoding')
+        response.set_etag(etag)
+        response.cache_control.no_cache = True  # Revalidate each poll; usually a 304
+        return response.make_conditional(request)
+
+wait_page = PrerenderedPage('wait.html', key_name='active_id', max_variants=256)
+logout_page = PrerenderedPage('logout.html')
+
 
 @app.route('/', methods=['GET', 'POST'])
 def login():
-    session.clear()  # Clears all session data
+    room = g.room
+    reset_session()  # Clears all session data
     # Show the login page where the user can enter their name
     if request.method == 'POST':
 
@@ -101,148 +941,47 @@ def login():
         name = request.form['name']
         session['name'] = name
         session['last_id'] = 0  # Initialize last_id to 0 after login
-        # Save the username in users.csv
-        file_exists = os.path.exists('users.csv')  # Check if file exists
-        with csv_lock_user:
-            with open('users.csv', mode='a', newline='', encoding='utf-8') as file:
-                writer = csv.writer(file)
-                writer.writerow([name])  # Append the new name
+        # Issue the session id up front, so a retried first vote carries the
+        # same id as the original and the duplicate check can match them
+        session.setdefault('session_id', str(uuid.uuid4()))
+        # Add the name to the roster and queue it for users.csv (or the
+        # storage backend); a re-login under a known name is not stored again
+        if SHARED_STATE:
+            # With several workers, shared_sync adds it from storage instead
+            if not room.user_roster.contains(name):
+                room.user_writer.submit(name)
+        elif room.user_roster.add(name):
+            room.user_writer.submit(name)
+            room.event_broker.publish('user', {'name': name})
 
         return redirect(url_for('survey'))  # Redirect to the survey page after login
 
     # Render the login page
-    return render_template_string('''
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Login</title>
-        <style>
-            body {
-                font-family: Arial, sans-serif;
-                height: 100vh;
-                display: flex;
-                justify-content: center;
-                align-items: center;
-                margin: 0;
-                background-color: #f4f4f9;
-            }
-            .container {
-                text-align: center;
-                padding: 40px; /* Increased padding */
-                background-color: white;
-                box-shadow: 0 8px 16px rgba(0, 0, 0, 0.2); /* Increased shadow */
-                border-radius: 16px; /* Increased border radius */
-                font-size: 2em; /* Increased font size */
-            }
-            h1 {
-                color: #333;
-                font-size: 2em; /* Increased font size */
-            }
-            form {
-                margin-top: 40px; /* Increased margin */
-            }
-            input[type="text"] {
-                padding: 20px; /* Increased padding */
-                width: 400px; /* Increased width */
-                margin: 20px 0; /* Increased margin */
-                border: 2px solid #ccc; /* Increased border thickness */
-                border-radius: 8px; /* Increased border radius */
-                font-size: 1em; /* Increased font size */
-            }
-            input[type="submit"] {
-                padding: 20px 40px; /* Increased padding */
-                background-color: #4CAF50;
-                color: white;
-                border: none;
-                border-radius: 8px; /* Increased border radius */
-                cursor: pointer;
-                font-size: 1em; /* Increased font size */
-            }
-            input[type="submit"]:hover {
-                background-color: #45a049;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>Please enter your name to continue</h1>
-            <form action="/" method="POST">
-                <label for="name">Name:</label><br>
-                <input type="text" id="name" name="name" required><br>
-                <input type="submit" value="Login">
-            </form>
-        </div>
-    </body>
-    </html>
-    ''')
+    return render_template('login.html')
 
 @app.route('/users')
 def users():
-    users_list = []
-
-    # Read user names from users.csv
-    if os.path.exists('users.csv'):
-        with open('users.csv', mode='r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            users_list = [row[0] for row in reader if row]
-    # Retrieve active ID from active.csv
-    try:
-        with open('active.csv', 'r') as active_file:
-            active_id = int(active_file.read().strip())  # Read and parse active ID
-    except FileNotFoundError:
-        active_id = 0  # Default to 0 if the file is missing
+    room = g.room
+    # Retrieve active ID from memory
+    active_id = room.active_question.get()
+
+    # The page only changes with the active id and the user list
+    return versioned_page(f"users-{active_id}-{room.user_roster.version}",
+                          lambda: render_users_page(room, active_id))
+
+def render_users_page(room, active_id):
+    # Count and names come from the in-memory roster
+    user_count, users_text = room.user_roster.summary()
 
     # Determine whether to auto-refresh
     should_refresh = active_id == 0  # True if active_id is 0, otherwise False
 
-
-    
-    user_count = len(users_list)
-    users_text = ", ".join(users_list) if users_list else "No users logged in"
+    if not user_count:
+        users_text = "No users logged in"
 
     # Render the users page
-    return render_template_string('''
-    <!DOCTYPE html>
-    <html>
-    <head>
-        {% if should_refresh %}
-            <meta http-equiv="refresh" content="3">
-        {% endif %}
-        <title>Users</title>
-        <style>
-            body {
-                font-family: Arial, sans-serif;
-                height: 100vh;
-                display: flex;
-                justify-content: center;
-                align-items: center;
-                margin: 0;
-                background-color: #f4f4f9;
-            }
-            .container {
-                text-align: center;
-                padding: 20px;
-                background-color: white;
-                box-shadow: 0 4px 8px rgba(0, 0, 0, 0.1);
-                border-radius: 8px;
-            }
-            h1 {
-                color: #333;
-            }
-            .bold {
-                font-weight: bold;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>Users Logged In:</h1>
-            <p><span class="bold">{{ user_count }}</span></p>
-            <p>{{ users_text }}</p>
-        </div>
-    </body>
-    </html>
-    ''', user_count=user_count, users_text=users_text, should_refresh=should_refresh)
+    return render_template('users.html', user_count=user_count, users_text=users_text,
+                           should_refresh=should_refresh, active_id=active_id)
 
 
 @app.route('/survey', methods=['GET', 'POST'])
@@ -250,60 +989,22 @@ def survey():
     # Check if the user has logged in (i.e., the name exists in the session)
     if 'name' not in session:
         return redirect(url_for('login'))
+    room = g.room
     
-    # Retrieve active ID from active.csv
-    try:
-        with open('active.csv', 'r') as active_file:
-            active_id = int(active_file.read().strip())  # Read and parse active ID
-    except FileNotFoundError:
-        active_id = 0  # Default to 0 if the file is missing
+    # Retrieve active ID from memory
+    active_id = room.active_question.get()
 
     # Retrieve last ID from session (initialize if not found)
     last_id = int(session.get('last_id', 0))
 
+    # Look up the active question in the parsed catalogue
+    question = room.question_catalogue.get(active_id)
+
     # Modify the condition to check if last_id >= active_id or active_id < 2
-    if last_id > active_id or active_id < 2:
-        # Display the "Please wait..." page with active and last IDs
-        return render_template_string('''
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta http-equiv="refresh" content="3">
-            <title>Please Wait</title>
-            <style>
-                body {
-                    font-family: Arial, sans-serif;
-                    height: 100vh;
-                    display: flex;
-                    justify-content: center;
-                    align-items: center;
-                    margin: 0;
-                    background-color: #f4f4f9;
-                }
-                .container {
-                    text-align: center;
-                    padding: 40px; /* Increased padding */
-                    background-color: white;
-                    box-shadow: 0 8px 16px rgba(0, 0, 0, 0.2); /* Increased shadow */
-                    border-radius: 16px; /* Increased border radius */
-                    width: 800px; /* Increased width */
-                }
-                h1 {
-                    color: #333;
-                    font-size: 48px; /* Increased font size */
-                }
-                p {
-                    font-size: 36px; /* Increased font size */
-                }
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <h1>Please wait...</h1>
-            </div>
-        </body>
-        </html>
-        ''')
+    # (also wait if the active id points past the end of data.csv)
+    if last_id > active_id or active_id < 2 or question is None:
+        # Display the "Please wait..." page, pre-rendered per active id
+        return wait_page.response(active_id)
 
     # Process the survey as normal if last_id < active_id
     if request.method == 'POST':
@@ -326,12 +1027,22 @@ def survey():
         session_id = session['session_id']
         session_data = [session_id, name, last_id, selected_opinion]
 
-        # Append the data to session.csv
-        with csv_lock_session:  # Acquire the lock to prevent concurrent read/write
-            with open('session.csv', mode='a', newline='', encoding='utf-8') as file:
-                writer = csv.writer(file)
-                writer.writerow(session_data)
-                logging.info("new inserted data: %s",session_data)
+        # Count the vote in memory and queue it for session.csv; the vote
+        # writer appends it in the background together with other votes.
+        # With several workers, shared_sync counts it once it is stored.
+        # A resubmission (double tap, browser retry) is settled by the
+        # duplicate vote policy using the tally's per-session index.
+        if SHARED_STATE:
+            counted = room.vote_tally.accepts(int(last_id), selected_opinion, session_id)
+        else:
+            counted = room.vote_tally.record(int(last_id), selected_opinion, name, session_id)
+        if counted or VOTE_DUPLICATE_POLICY == 'count-latest':
+            room.vote_writer.submit(session_data)
+            logging.info("new inserted data: %s",session_data)
+        else:
+            logging.info("duplicate vote ignored: %s", session_data)
+        if counted and not SHARED_STATE:
+            room.event_broker.publish('vote', {'id': int(last_id)})
 
         # Update the session's last_id after submission
         session['last_id'] = str(int(last_id) + 1)  # Increment last_id by 1
@@ -347,16 +1058,9 @@ def survey():
     # Retrieve the name from the session
     name = session['name']
 
-    # Get the row corresponding to the last_id
-    data = read_csv_data()
-    row = data[int(active_id) - 1]
-    chart_title = row[0]  # First column is the chart title
-    raw_data = row[1:]  # Remaining columns contain key-value pairs
-
-    # Extract keys from the row to be used as options
-    options = [raw_data[i] for i in range(0, len(raw_data), 2)]  # Extract every alternate value (key)
-    # Filter out empty keys
-    options = [option for option in options if option.strip()]
+    # Use the question corresponding to the active id
+    chart_title = question.title  # First column is the chart title
+    options = question.options  # Non-empty option labels
 
     # Update the session's last_id after showing
     session['last_id'] = str(int(active_id))
@@ -364,168 +1068,15 @@ def survey():
 
     
     # Display the survey page
-    return render_template_string('''
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta http-equiv="refresh" content="20">
-        <title>Survey</title>
-        <style>
-            body {
-                font-family: Arial, sans-serif;
-                height: 100vh;
-                display: flex;
-                justify-content: center;
-                align-items: center;
-                margin: 0;
-                background-color: #f4f4f9;
-            }
-            .container {
-                text-align: center;
-                padding: 40px; /* Increased padding */
-                background-color: white;
-                box-shadow: 0 8px 16px rgba(0, 0, 0, 0.2); /* Increased shadow */
-                border-radius: 16px; /* Increased border radius */
-                width: 800px; /* Increased width */
-            }
-            h1 {
-                color: #333;
-                font-size: 48px; /* Increased font size */
-            }
-            form {
-                margin-top: 40px; /* Increased margin */
-                text-align: left;
-            }
-            .question {
-                margin-bottom: 40px; /* Increased margin */
-                font-size: 36px; /* Increased font size */
-                font-weight: bold;
-            }
-            .options {
-                margin: 20px 0; /* Increased margin */
-            }
-            .option-item {
-                margin-bottom: 30px; /* Increased margin */
-            }
-            input[type="radio"] {
-                margin-right: 20px; /* Increased margin */
-                transform: scale(2); /* Increased radio button size */
-            }
-            input[type="submit"] {
-                padding: 20px 40px; /* Increased padding */
-                background-color: #4CAF50;
-                color: white;
-                border: none;
-                border-radius: 8px; /* Increased border radius */
-                cursor: pointer;
-                font-size: 36px; /* Increased font size */
-            }
-            input[type="submit"]:hover {
-                background-color: #45a049;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>Hi, {{ name }}!</h1>
-            <form action="/survey" method="POST">
-                <div class="question">
-                    <p>{{ chart_title }}</p>  <!-- Display chart title as the question -->
-                </div>
-                {{logout_trigger}} 
-                <div class="options">
-                    {% for option in options %}
-                    <div class="option-item"> <!-- Add a class to each radio button line -->
-                        <input type="radio" id="{{ option }}" name="answer" value="{{ option }}" required>
-                        <label for="{{ option }}" style="font-size: 36px;">{{ option }}</label> <!-- Increased font size -->
-                    </div>
-                    {% endfor %}
-                </div>
-                {% if chart_title == "Do you have any question?" %}
-                    <input type="hidden" name="logout_trigger" value="1">
-                {% endif %}
-                <input type="submit" value="Submit">
-            </form>
-        </div>
-    </body>
-    </html>
-    ''', name=name, chart_title=chart_title, options=options)
-
-def count_records_in_session(row_id):
-    with csv_lock_session:  # Acquire the lock to prevent concurrent access
-        with open('session.csv', mode='r', newline='', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            data = list(reader)
-
-        # Count records where third column == row_id + 1, group by the fourth column
-        active_id = row_id + 1
-        grouped_data = {}
-        
-        for row in data:
-            if len(row) >= 4 and row[2] == str(active_id):  # Check if third column matches row_id + 1
-                key = row[3]  # Fourth column to group by
-                if key not in grouped_data:
-                    grouped_data[key] = 0
-                grouped_data[key] += 1
-
-        return grouped_data
-
-
-@app.route('/chart', methods=['GET'])
-def chart():
-    # Retrieve the 'id' from the GET parameter and store it
-    row_id = int(request.args.get('id', 1)) - 1  # Convert ID to zero-based index
-    
-    # Read the current active ID from the file
-    try:
-        with open('active.csv', 'r') as active_file:
-            current_active_id = int(active_file.read().strip())
-    except (FileNotFoundError, ValueError):
-        current_active_id = 0  # Default to 0 if the file is missing or has invalid data
-
-    # Update the active ID only if it is lower than row_id + 1
-    new_active_id = row_id + 1
-
-    
-    grouped_data = count_records_in_session(row_id)
-    
-    # Determine whether to auto-refresh
-    should_refresh = current_active_id + 2 >= new_active_id and new_active_id + 2 >= current_active_id
-
-     
-    # Now proceed with the rest of your logic
-    data = read_csv_data()
-
-    if row_id < 1 or row_id >= len(data):
-        return f"Invalid chart ID: {row_id}"
-
-    row = data[row_id]
-    chart_title = row[0]  # First column is the chart title
-    raw_data = row[1:]  # Remaining columns contain key-value pairs
-
-    if chart_title == "Do you have any question?":
-        extracted_names = []
-
-        try:
-            with open('session.csv', mode='r', encoding='utf-8') as file:
-                reader = csv.reader(file)
-
-                for row in reader:
-                    if len(row) >= 4 and row[2].strip() == str(new_active_id) and row[3].strip().lower() == "yes":
-                        extracted_names.append(row[1].strip())  # Second column (name)
-            
-            # Format as "1- xxx, 2- yyy, ..."
-            formatted_names = [f"{i+1}- {name}" for i, name in enumerate(extracted_names)]
-        except FileNotFoundError:
-            app.logger.error("session.csv not found.")
-            data = []  # Set empty data if file is missing
-        except Exception as e:
-            app.logger.error(f"Error reading session.csv: {e}")
-            formatted_names = []
-    else:
-        formatted_names = []
-
-    labels, values = [], []
+    return versioned_page(
+        f"survey-{active_id}-{room.question_catalogue.generation}-{name}",
+        lambda: render_template('survey.html', name=name, chart_title=chart_title, options=options,
+                                active_id=active_id))
+
+def chart_labels_values(question, grouped_data):
+    # Labels and vote counts for the bars of a question's chart, from its
+    # counts in a tally snapshot
+    raw_data = question.to_row()[1:]  # Key-value pairs after the title
     updated_raw_data = []
 
     # Parse raw_data field by field
@@ -545,19 +1096,9 @@ def chart():
 
         i += 2  # Move to the next key-value pair
     
-    # Update the data at the specific row_id with the new raw_data
+    # Use the counted values for the chart; data.csv is updated in the
+    # background by count_snapshot rather than on every render
     raw_data = updated_raw_data
-    data[row_id] = [chart_title] + updated_raw_data
-
-    try:
-        # Save all data back to CSV file with locking mechanism
-        with csv_lock_data:
-            with open('data.csv', mode='w', newline='', encoding='utf-8') as file:
-                writer = csv.writer(file)
-                writer.writerows(data)
-    except Exception as e:
-        app.logger.error(f"Error writing to CSV: {e}")
-        return "Error updating chart data."
 
     labels, values = [], []
 
@@ -574,101 +1115,220 @@ def chart():
         except ValueError:
             continue  # Skip if value is not a valid number
 
+    return labels, values
+
+
+def chart_etag(room, question_id, version, generation):
+    # Validator for a chart image: changes with the question's tally version,
+    # with edits to data.csv, and on every restart
+    return f"{BOOT_ID}-{room.id}-{question_id}-{version}-{generation}"
+
+
+class ChartCache:
+    # LRU cache of rendered chart PNGs, shared by all rooms. Keys are (room id,
+    # question id, tally version, catalogue generation), so a chart is only
+    # redrawn after a new vote for that question (or an edit to data.csv) and
+    # every viewer shares one render. Different charts render concurrently.
+    def __init__(self, max_size):
+        self.lock = threading.Lock()
+        self.rendering = {}  # key -> Future of a render in progress
+        self.images = OrderedDict()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            png = self.images.get(key)
+            if png is not None:
+                self.images.move_to_end(key)
+                self.hits += 1
+            return png
+
+    def put(self, key, png):
+        if self.max_size <= 0:
+            return  # Caching disabled
+        with self.lock:
+            self.images[key] = png
+            self.images.move_to_end(key)
+            while len(self.images) > self.max_size:
+                self.images.popitem(last=False)  # Evict the least recently used chart
+
+    def get_or_render(self, key, render):
+        png = self.get(key)
+        if png is not None:
+            return png
+        with self.lock:
+            # Viewers asking for a chart that is being drawn wait for that
+            # render instead of starting their own
+            pending = self.rendering.get(key)
+            if pending is None:
+                pending = self.rendering[key] = Future()
+                self.misses += 1
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            return pending.result()  # Raises the renderer's error as well
+        try:
+            start = time.perf_counter()
+            png = render()
+            chart_render_duration.observe(time.perf_counter() - start)
+            self.put(key, png)
+            pending.set_result(png)
+            return png
+        except Exception as e:
+            pending.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.rendering[key]
+
+chart_cache = ChartCache(max_size=int(os.environ.get('CHART_CACHE_SIZE', 64)))
+
+# Charts are drawn by CHART_RENDER_WORKERS processes (0 draws them in the
+# request thread). A chart that cannot get one of the workers +
+# CHART_RENDER_QUEUE slots, or is not done within CHART_RENDER_TIMEOUT
+# seconds, is answered with a 503 so the browser retries.
+chart_renderer = ChartRenderer(
+    workers=int(os.environ.get('CHART_RENDER_WORKERS', 2)),
+    queue_size=int(os.environ.get('CHART_RENDER_QUEUE', 16)),
+    timeout=float(os.environ.get('CHART_RENDER_TIMEOUT', 10)))
+
+metrics.sampled('poll_chart_cache_hits_total', 'Chart PNGs served from the cache.', 'counter',
+                lambda: chart_cache.hits)
+metrics.sampled('poll_chart_cache_misses_total', 'Chart PNGs that had to be rendered.', 'counter',
+                lambda: chart_cache.misses)
+metrics.sampled('poll_chart_render_rejected_total', 'Chart PNGs refused because the renderer was busy.',
+                'counter', lambda: chart_renderer.rejected)
+metrics.sampled('poll_chart_cache_hit_ratio', 'Share of chart PNG lookups served from the cache.', 'gauge',
+                lambda: chart_cache.hits / max(chart_cache.hits + chart_cache.misses, 1))
+
+# 'server' renders /chart with Matplotlib, 'client' leaves drawing to
+# static/chart.js; a ?render= query parameter overrides it per request
+CHART_RENDER_MODE = os.environ.get('CHART_RENDER_MODE', 'server')
+
+
+@app.route('/chart', methods=['GET'])
+def chart():
+    # Retrieve the 'id' from the GET parameter and store it
+    row_id = int(request.args.get('id', 1)) - 1  # Convert ID to zero-based index
+    room = g.room
+    
+    # Read the current active ID from memory
+    current_active_id = room.active_question.get()
+
+    # Update the active ID only if it is lower than row_id + 1
+    new_active_id = row_id + 1
+
+    
+    # Determine whether to auto-refresh
+    should_refresh = current_active_id + 2 >= new_active_id and new_active_id + 2 >= current_active_id
+
+     
+    # Now proceed with the rest of your logic; the generation is read before
+    # the question, as in chart_image()
+    generation = room.question_catalogue.generation
+    question = room.question_catalogue.get(new_active_id)
+
+    if row_id < 1 or question is None:
+        return f"Invalid chart ID: {row_id}"
+
+    chart_title = question.title  # First column is the chart title
+
+    # Counts, hand-raise list and the version in the page's ETag all come
+    # from one snapshot, so a vote mid-request cannot leave the new ETag on
+    # a page showing the old data
+    tally = room.vote_tally.snapshot(new_active_id, "yes")
+
+    if chart_title == "Do you have any question?":
+        # Names that answered "yes", from the tally's respondent index
+        extracted_names = tally.respondents
+
+        # Format as "1- xxx, 2- yyy, ..."
+        formatted_names = [f"{i+1}- {name}" for i, name in enumerate(extracted_names)]
+    else:
+        formatted_names = []
+
+    labels, values = chart_labels_values(question, tally.counts)
+
     # Check if there are any valid labels and values
     if not labels or not values:
         return "No valid data for chart"
 
-    # Ensure max_value is not zero before proceeding with chart generation
-    max_value = max(values) if values else 1  # Default to 1 if values are empty to avoid division by zero
-    if max_value == 0:
-        max_value = 1  # Fallback value to avoid zero division
-    # Set larger figure size and remove the border
-    fig, ax = plt.subplots(figsize=(10, 5))  # Increased panel size
+    # The image itself is served by chart_image() so browsers can cache it
+    img_url = url_for('chart_image', question_id=new_active_id)
+
+    # In client mode the browser draws the bars from the counts and the
+    # server skips Matplotlib entirely; the PNG stays available at img_url
+    render_mode = request.args.get('render', CHART_RENDER_MODE)
+
+    # Same votes, question text, active id and mode means the same page
+    version = (f"chart-{new_active_id}-{tally.version}"
+               f"-{generation}-{current_active_id}-{render_mode}")
+    return versioned_page(version, lambda: render_template(
+        'chart.html', title=chart_title, img_url=img_url,
+        render_mode=render_mode, labels=labels, values=values,
+        should_refresh=should_refresh, formatted_names=formatted_names,
+        active_id=current_active_id, chart_id=new_active_id))
+
+
+@app.route('/chart/<int:question_id>.png', methods=['GET'])
+def chart_image(question_id):
+    room = g.room
+    # Read before the question, so an edit to data.csv in between can only
+    # file the new text under the old generation, never the reverse
+    generation = room.question_catalogue.generation
+    question = room.question_catalogue.get(question_id)
+    if question_id < 2 or question is None:
+        return f"Invalid chart ID: {question_id - 1}", 404
+
+    # Answer revalidation from the tally version alone, without rendering.
+    # The validators, the counts drawn and the cache key all come from one
+    # snapshot, so a vote landing mid-request cannot pair a new version
+    # with an image of the old counts.
+    tally = room.vote_tally.snapshot(question_id)
+    etag = chart_etag(room, question_id, tally.version, generation)
+    last_modified = datetime.fromtimestamp(
+        max(tally.modified_at, room.question_catalogue.changed_at), timezone.utc)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+    else:
+        labels, values = chart_labels_values(question, tally.counts)
+        if not labels or not values:
+            return "No valid data for chart", 404
 
-    # Generate colors dynamically
-    colors = plt.cm.Paired(np.linspace(0, 1, len(labels)))
-    
-    # Draw horizontal bars with a fixed panel size
-    bar_widths = [v / max_value * 0.6 for v in values]  # Scale bars dynamically
-
-    y_positions = range(len(labels))
-    ax.barh(y_positions, bar_widths, color=colors, height=0.3)
-
-    # Remove x and y axis labels and borders
-    ax.set_xticks([])
-    ax.set_yticks([])
-    ax.set_yticklabels([])
-
-    # Remove the top and left spines (borders)
-    ax.spines['top'].set_visible(False)
-    ax.spines['left'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-    ax.spines['bottom'].set_visible(False)
-
-
-    # Add text labels for keys and values
-    for i in range(len(labels)):
-        label = labels[i]
-        value = values[i]
-        
-        # Place the key label on the left side of the bar
-        ax.text(-0.2 , i + 0.25, label, va='center', ha='left', fontsize=16, color='black', fontweight='bold')
-        
-        # Place the value label on the right side of the bar
-        ax.text(bar_widths[i] + 0.02, i, str(int(value)), va='center', fontsize=18)
-
-    # Save the chart as an image without border
-    img = io.BytesIO()
-    plt.savefig(img, format='png', bbox_inches='tight', pad_inches=0)  # Remove border
-    img.seek(0)
-    img_base64 = base64.b64encode(img.getvalue()).decode('utf-8')
-
-    # Close the figure to avoid excessive memory usage
-    plt.close(fig)
-
-    # Continue rendering the image as before
-    html = '''
-    <!DOCTYPE html>
-    <html>
-    <head>
-        {% if should_refresh %}
-            <meta http-equiv="refresh" content="3">
-        {% endif %}
-        <title>Chart</title>
-    </head>
-    <body>
-        <h1>{{ title }}</h1>
-        <img src="data:image/png;base64,{{ img_base64 }}" alt="Chart" style="height:auto;"/>
-        {% if formatted_names %}
-            <p><strong>{{ formatted_names | join(', ') }}</strong></p>
-        {% endif %}
-    </body>
-    </html>
-    '''
-    return render_template_string(html, title=chart_title, img_base64=img_base64, 
-                                  should_refresh=should_refresh, formatted_names=formatted_names)
+        # Reuse the PNG rendered for this exact tally if we have one
+        cache_key = (room.id, question_id, tally.version, generation)
+        try:
+            png = chart_cache.get_or_render(
+                cache_key, lambda: chart_renderer.render(question.title, labels, values))
+        except ChartRenderUnavailable as e:
+            logging.warning("chart %s not rendered: %s", question_id, e)
+            return "Chart is busy, try again", 503, {'Retry-After': '1'}
+        response = Response(png, mimetype='image/png')
+
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True  # Always revalidate; a 304 is cheap
+    return response
 
 
 @app.route('/activate', methods=['GET'])
 def activate():
     new_active_id = int(request.args.get('id', 1))
-    
+    room = g.room
+
+    # Save the new active ID if it is past the current one; the comparison and
+    # the write to 'active.csv' are a single atomic step
     try:
-        with open('active.csv', 'r') as active_file:
-            current_active_id = int(active_file.read().strip())
-    except (FileNotFoundError, ValueError):
-        current_active_id = 0  # Default to 0 if the file is missing or has invalid data
-
-        
-    # Save the new active ID to 'active.csv'
-    if new_active_id>current_active_id:
-        try:
-            with csv_lock_active:
-                with open('active.csv', 'w') as active_file:
-                    active_file.write(str(new_active_id))  # Store the updated ID
-        except Exception as e:
-            app.logger.error(f"Error saving active ID: {e}")
-            return "Error saving active ID", 500
+        advanced = room.active_question.advance(new_active_id)
+    except Exception as e:
+        app.logger.error(f"Error saving active ID: {e}")
+        return "Error saving active ID", 500
+
+    if advanced:
+        room.event_broker.publish('active', {'id': new_active_id})
 
     return redirect(url_for('chart', id=new_active_id))
 
@@ -676,49 +1336,168 @@ def activate():
 def logout():
     """Logs out the user by clearing the session and redirects to login page after 10 seconds."""
     session.clear()  # Remove all session data
-    return render_template_string('''
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Logout</title>
-        <meta http-equiv="refresh" content="10;url={{ url_for("login") }}">  <!-- Redirect after 10 seconds -->
-        <style>
-            body {
-                font-family: Arial, sans-serif;
-                height: 100vh;
-                display: flex;
-                justify-content: center;
-                align-items: center;
-                margin: 0;
-                background-color: #f4f4f9;
-            }
-            .container {
-                text-align: center;
-                padding: 40px;
-                background-color: white;
-                box-shadow: 0 8px 16px rgba(0, 0, 0, 0.2);
-                border-radius: 16px;
-                width: 800px;
-            }
-            h1 {
-                color: #333;
-                font-size: 48px;
-            }
-            p {
-                font-size: 36px;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>Thank you for participating in this survey</h1>
-        </div>
-    </body>
-    </html>
-    ''')
+    return logout_page.response()
+
+
+# Each open /events stream holds a request thread for as long as its page is
+# open, so serve.py caps them well below its thread pool; pages that are
+# refused fall back to timed reloads. 0 means no cap (the development
+# server's threads are unbounded, and asgi.py streams on its event loop).
+EVENT_STREAM_LIMIT = int(os.environ.get('EVENT_STREAM_LIMIT', 0))
+event_stream_slots = threading.BoundedSemaphore(EVENT_STREAM_LIMIT) if EVENT_STREAM_LIMIT > 0 else None
+
+@app.route('/events')
+def events():
+    """Server-sent event stream of 'active', 'vote' and 'user' events."""
+    if event_stream_slots is not None and not event_stream_slots.acquire(blocking=False):
+        return "Too many live connections", 503, {'Retry-After': '30'}
+    event_broker = g.room.event_broker
+    active_id = g.room.active_question.get()
+    subscriber = event_broker.subscribe()
+
+    def stream():
+        try:
+            # Tell the browser how fast to reconnect, then send the current
+            # state so a client that missed events while away catches up
+            yield 'retry: 3000\n\n'
+            yield f"event: active\ndata: {json.dumps({'id': active_id})}\n\n"
+            while True:
+                try:
+                    yield subscriber.get(timeout=15)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'  # Lets us notice closed connections
+        finally:
+            event_broker.unsubscribe(subscriber)
+
+    response = Response(stream(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    if event_stream_slots is not None:
+        # Released when the server closes the response, even if the stream
+        # was never started
+        response.call_on_close(event_stream_slots.release)
+    return response
+
+
+# Render the start-of-session variants now rather than on the first request
+with app.test_request_context():
+    wait_page.variant(0)
+    logout_page.variant()
+
+
+# Read-only JSON views of the in-memory state. These never touch the CSV
+# files or Matplotlib, so dashboards and scripts can poll them cheaply.
+@app.route('/api/active')
+def api_active():
+    return jsonify(id=g.room.active_question.get())
+
+
+@app.route('/api/tally/<int:question_id>')
+def api_tally(question_id):
+    room = g.room
+    question = room.question_catalogue.get(question_id)
+    if question_id < 2 or question is None:
+        return jsonify(error=f"Invalid chart ID: {question_id - 1}"), 404
+
+    # One snapshot, so the version always belongs to the counts beside it
+    tally = room.vote_tally.snapshot(question_id)
+    counts = [{'option': option, 'votes': tally.counts.get(option, 0)} for option in question.options]
+    return jsonify(id=question_id, title=question.title, version=tally.version,
+                   counts=counts, total=sum(tally.counts.values()))
+
+
+@app.route('/api/users')
+def api_users():
+    users_list = g.room.user_roster.names()
+    return jsonify(count=len(users_list), users=users_list)
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Request, lock and chart timings in the Prometheus text format."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+class SharedStateSync:
+    # Keeps this process's in-memory state in step with storage when several
+    # worker processes share it. Every interval seconds it reads the votes
+    # and users appended since the last look (by file offset or row id) and
+    # the stored active id, applies them, and publishes the matching events to
+    # this process's /events subscribers. One per room.
+    def __init__(self, room, interval):
+        self.room = room
+        self.interval = interval
+        self.vote_cursor = 0
+        self.user_cursor = 0
+        self.thread = None
+
+    def start(self):
+        room = self.room
+        self.vote_cursor = room.recover_votes()
+        names, self.user_cursor, _ = room.storage.users_since(0)
+        room.user_roster.load(names)
+        room.active_question.load()
+        self.thread = threading.Thread(target=self._run, name='shared-sync', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sync()
+            except Exception as e:
+                app.logger.error(f"Error syncing shared state: {e}")
+
+    def sync(self):
+        room = self.room
+        rows, self.vote_cursor, truncated = room.storage.votes_since(self.vote_cursor)
+        if truncated:
+            room.vote_tally.rebuild(rows)
+        voted = set()
+        for row in rows:
+            try:
+                question_id = int(row[2])
+            except ValueError:
+                continue  # Skip rows without a valid question id
+            if truncated or room.vote_tally.record(question_id, row[3], row[1], row[0]):
+                voted.add(question_id)
+        for question_id in sorted(voted):
+            room.event_broker.publish('vote', {'id': question_id})
+
+        names, self.user_cursor, truncated = room.storage.users_since(self.user_cursor)
+        if truncated:
+            room.user_roster.load(names)
+            added = names
+        else:
+            added = [name for name in names if room.user_roster.add(name)]
+        for name in added:
+            room.event_broker.publish('user', {'name': name})
+
+        if room.active_question.observe(room.storage.load_active()):
+            room.event_broker.publish('active', {'id': room.active_question.get()})
+
+SHARED_SYNC_INTERVAL = float(os.environ.get('SHARED_SYNC_INTERVAL', 0.25))
+
+worker_started = False
+worker_lock = threading.Lock()
+
+def start_worker():
+    # Start the default room in this process (after the fork, for serve.py
+    # workers); other rooms start on their first request. Later calls
+    # return immediately.
+    global worker_started
+    if worker_started:
+        return
+    with worker_lock:
+        if worker_started:
+            return
+        rooms.get(DEFAULT_ROOM)
+        chart_renderer.start()
+        worker_started = True
 
 
 if __name__ == '__main__':
+    # Development server; use serve.py in production
     initialize_files()
+    start_worker()
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port)
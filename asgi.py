@@ -0,0 +1,307 @@
+import asyncio
+import io
+import json
+import os
+import queue
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from itsdangerous import BadSignature
+from werkzeug.http import parse_accept_header, parse_cookie, parse_etags
+
+import app as poll_app
+
+# Async entry point for rooms with thousands of phones. The two requests
+# idle participants keep open or repeat, the /events stream and the wait
+# page on /survey, are answered on the event loop, so a waiting phone costs
+# a coroutine instead of a request thread. Every other route (/, /survey
+# with a question, /users, /chart, /activate, ...) runs the Flask app
+# unchanged on a thread pool, which keeps chart rendering and file I/O off
+# the loop.
+#
+#   python asgi.py                     (resets the session, like serve.py)
+#   uvicorn asgi:application --port 5000 --timeout-graceful-shutdown 5
+#
+#   PORT         port to listen on (default 5000)
+#   WEB_THREADS  threads running Flask requests (default 8)
+#
+# /events streams never end on their own, so shutdown only waits
+# SHUTDOWN_GRACE seconds for them before closing them.
+#
+# One process; the in-memory state is not shared between uvicorn --workers.
+
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 8))
+KEEP_ALIVE_INTERVAL = 15
+SHUTDOWN_GRACE = 5
+
+flask_app = poll_app.app
+executor = ThreadPoolExecutor(max_workers=WEB_THREADS, thread_name_prefix='flask')
+
+
+class LoopSubscriber:
+    # EventBroker subscriber for one /events coroutine. publish() runs on
+    # request and sync threads, so messages are handed to the loop thread.
+    def __init__(self, loop, queue_size):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+    def put_nowait(self, message):
+        if self.queue.full():
+            raise queue.Full  # Slow client; the broker drops the message
+        try:
+            self.loop.call_soon_threadsafe(self.deliver, message)
+        except RuntimeError:
+            pass  # Loop already closed at shutdown
+
+    def deliver(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            pass
+
+
+def header_map(scope):
+    headers = {}
+    for name, value in scope['headers']:
+        name = name.decode('latin-1')
+        value = value.decode('latin-1')
+        if name in headers:
+            # Repeated headers are folded the way WSGI servers do
+            value = headers[name] + ('; ' if name == 'cookie' else ', ') + value
+        headers[name] = value
+    return headers
+
+
+def started_room(room_id):
+    # The room if it is already running in this process; opening and
+    # starting one reads files, so that is left to the thread pool
+    room = poll_app.rooms.rooms.get(room_id or poll_app.DEFAULT_ROOM)
+    if room is None or not room.started:
+        return None
+    return room
+
+
+async def start_room(room_id):
+    # started_room(), starting the room on the thread pool if needed; None
+    # if there is no such room
+    room = started_room(room_id)
+    if room is None:
+        room = await asyncio.get_running_loop().run_in_executor(
+            executor, poll_app.rooms.get, room_id or poll_app.DEFAULT_ROOM)
+    return room
+
+
+def load_session(headers, room_id):
+    # The participant's session, decoded the way Flask would, or None
+    cookie_name = poll_app.session_cookie_name(flask_app.config['SESSION_COOKIE_NAME'], room_id)
+    value = parse_cookie(headers.get('cookie', '')).get(cookie_name)
+    if not value:
+        return None
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    try:
+        return serializer.loads(value, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return None
+
+
+async def send_response(send, status, headers, body=b''):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def wait_page(send, headers, room, room_id, prefix):
+    # The wait page for a participant with nothing to answer, or False to
+    # let Flask handle the request (login, a question to show, a session
+    # from before this start that clear_session() must reset, ...)
+    session = load_session(headers, room_id)
+    if not session or session.get('epoch') != poll_app.SESSION_EPOCH or 'name' not in session:
+        return False
+    active_id = room.active_question.get()
+    last_id = int(session.get('last_id', 0))
+    # Same test as survey()
+    if not (last_id > active_id or active_id < 2 or room.question_catalogue.get(active_id) is None):
+        return False
+    variant = poll_app.wait_page.variants.get((prefix, active_id))
+    if variant is None:
+        return False  # Flask renders and caches it on first use
+
+    etag, bodies = variant
+    accepted = parse_accept_header(headers.get('accept-encoding'))
+    encoding = next((encoding for encoding in poll_app.AVAILABLE_ENCODINGS if accepted[encoding]), None)
+    response_headers = [('Content-Type', 'text/html; charset=utf-8'), ('Cache-Control', 'no-cache'),
+                        ('Vary', 'Accept-Encoding, Cookie')]
+    if encoding is not None:
+        response_headers.append(('Content-Encoding', encoding))
+        etag += '-' + encoding
+    response_headers.append(('ETag', f'"{etag}"'))
+    if parse_etags(headers.get('if-none-match')).contains(etag):
+        await send_response(send, 304, response_headers)
+    else:
+        body = bodies[encoding]
+        response_headers.append(('Content-Length', str(len(body))))
+        await send_response(send, 200, response_headers, body)
+    return True
+
+
+async def events(receive, send, room):
+    # Same stream as the /events route, fed by the room's EventBroker
+    event_broker = room.event_broker
+    subscriber = LoopSubscriber(asyncio.get_running_loop(), event_broker.queue_size)
+    event_broker.subscribe(subscriber)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'), (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no')]})
+        active = json.dumps({'id': room.active_question.get()})
+        await send_chunk(send, f"retry: 3000\n\nevent: active\ndata: {active}\n\n")
+        while not disconnected.done():
+            message = asyncio.ensure_future(subscriber.queue.get())
+            done, _ = await asyncio.wait({message, disconnected}, timeout=KEEP_ALIVE_INTERVAL,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if message in done:
+                await send_chunk(send, message.result())
+                continue
+            message.cancel()
+            if not disconnected.done():
+                await send_chunk(send, ': keep-alive\n\n')
+    finally:
+        event_broker.unsubscribe(subscriber)
+        disconnected.cancel()
+
+
+async def send_chunk(send, text):
+    await send({'type': 'http.response.body', 'body': text.encode('utf-8'), 'more_body': True})
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+def wsgi_environ(scope, headers, body):
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': '',
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        'CONTENT_LENGTH': str(len(body)),
+    }
+    for name, value in headers.items():
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'content-length':
+            environ['HTTP_' + name.upper().replace('-', '_')] = value
+    return environ
+
+
+def call_flask(environ):
+    # Runs on the thread pool; the whole response is buffered, so the one
+    # streaming route, /events, must never get here (see application())
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = headers
+
+    result = flask_app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], body
+
+
+async def delegate(scope, receive, send, headers):
+    body = await read_body(receive)
+    if body is None:
+        return  # Client went away before sending the request
+    loop = asyncio.get_running_loop()
+    status, response_headers, response_body = await loop.run_in_executor(
+        executor, call_flask, wsgi_environ(scope, headers, body))
+    await send_response(send, status, response_headers, response_body)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await asyncio.get_running_loop().run_in_executor(executor, poll_app.start_worker)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executor.shutdown(wait=True)  # Queued votes are flushed at exit
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return  # No websockets
+
+    start = time.perf_counter()
+    headers = header_map(scope)
+    room_id, prefix, path = poll_app.split_room_path(scope['path'])
+    if path == '/events':
+        # Always streamed here, even for a room that is not running yet
+        # (EventSource reconnects after a restart); buffering the endless
+        # stream in call_flask() would hang a pool thread for good
+        if scope['method'] != 'GET':
+            await send_response(send, 405, [('Allow', 'GET'), ('Content-Type', 'text/plain')])
+            return
+        room = await start_room(room_id)
+        if room is None:
+            await send_response(send, 404, [('Content-Type', 'text/plain; charset=utf-8')], b'Unknown room')
+            return
+        poll_app.request_duration.observe(time.perf_counter() - start, '/events', 'GET')
+        await events(receive, send, room)
+        return
+    room = started_room(room_id) if scope['method'] == 'GET' else None
+    if room is not None and path == '/survey' and await wait_page(send, headers, room, room_id, prefix):
+        poll_app.request_duration.observe(time.perf_counter() - start, '/survey', 'GET')
+        return
+    await delegate(scope, receive, send, headers)
+
+
+def main():
+    import uvicorn
+
+    # Same start-of-session reset as `python app.py` and serve.py
+    poll_app.initialize_files()
+    port = int(os.environ.get('PORT', 5000))
+    uvicorn.run(application, host='0.0.0.0', port=port, log_level='warning',
+                timeout_graceful_shutdown=SHUTDOWN_GRACE)
+
+
+if __name__ == '__main__':
+    main()
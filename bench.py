@@ -0,0 +1,198 @@
+import argparse
+import html
+import http.cookiejar
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+# Load test that simulates a live audience. N participants log in through /,
+# poll /survey and answer each question as it goes live, while a presenter
+# steps through /activate and keeps refreshing /chart (and its image). At the
+# end it prints request count, throughput and p50/p95/p99 latency per route.
+#
+#   python bench.py --participants 200                        # in-process
+#   python bench.py --url http://127.0.0.1:5000 --participants 200
+
+
+class InProcessClient:
+    # Calls the Flask app directly through its test client (one per user)
+    def __init__(self, flask_app):
+        self.client = flask_app.test_client()
+
+    def request(self, method, path, data=None, headers=None):
+        response = self.client.open(path, method=method, data=data, headers=headers)
+        return response.status_code, response.get_data(), response.headers
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Report redirects instead of following them, so each route is timed alone
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class HttpClient:
+    # Talks to a running server; keeps its own cookies like a browser would
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect())
+
+    def request(self, method, path, data=None, headers=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method, headers=headers or {})
+        try:
+            with self.opener.open(req, timeout=30) as response:
+                return response.status, response.read(), response.headers
+        except urllib.error.HTTPError as e:  # 3xx/4xx/5xx all arrive here
+            return e.code, e.read(), e.headers
+
+
+class Recorder:
+    # Latencies per route, shared by all simulated users
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def timed(self, client, route, method, path, data=None, headers=None):
+        start = time.perf_counter()
+        try:
+            status, body, response_headers = client.request(method, path, data=data, headers=headers)
+        except Exception:
+            status, body, response_headers = None, b'', {}
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.latencies.setdefault(route, []).append(elapsed)
+            if status is None or status >= 500:
+                self.errors[route] = self.errors.get(route, 0) + 1
+        return status, body, response_headers
+
+    def report(self, elapsed):
+        rows = []
+        with self.lock:
+            for route in sorted(self.latencies):
+                samples = sorted(self.latencies[route])
+                rows.append({
+                    'route': route,
+                    'requests': len(samples),
+                    'errors': self.errors.get(route, 0),
+                    'rps': len(samples) / elapsed if elapsed else 0.0,
+                    'p50_ms': percentile(samples, 50) * 1000,
+                    'p95_ms': percentile(samples, 95) * 1000,
+                    'p99_ms': percentile(samples, 99) * 1000,
+                })
+        return rows
+
+
+def percentile(samples, pct):
+    # Nearest-rank percentile of an already sorted list
+    if not samples:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(samples))))
+    return samples[min(rank, len(samples)) - 1]
+
+
+def participant(index, client, recorder, args, deadline):
+    recorder.timed(client, 'POST /', 'POST', '/', data={'name': f'participant{index}'})
+
+    while time.monotonic() < deadline:
+        status, body, _ = recorder.timed(client, 'GET /survey', 'GET', '/survey')
+        if status == 200 and b'name="answer"' in body:
+            options = re.findall(rb'name="answer" value="([^"]*)"', body)
+            if options:
+                time.sleep(random.uniform(0, args.think_time))  # Reading the question
+                answer = html.unescape(random.choice(options).decode('utf-8'))
+                data = {'answer': answer}
+                if b'name="logout_trigger"' in body:
+                    data['logout_trigger'] = '1'
+                recorder.timed(client, 'POST /survey', 'POST', '/survey', data=data)
+                if 'logout_trigger' in data:
+                    return  # The last question logs the participant out
+        # Jitter so the whole room does not poll in lockstep
+        time.sleep(args.poll_interval * random.uniform(0.8, 1.2))
+
+
+def presenter(client, recorder, args, deadline):
+    etags = {}
+    for question_id in range(2, 2 + args.questions):
+        recorder.timed(client, 'GET /activate', 'GET', f'/activate?id={question_id}')
+        question_end = min(deadline, time.monotonic() + args.question_seconds)
+        while time.monotonic() < question_end:
+            recorder.timed(client, 'GET /chart', 'GET', f'/chart?id={question_id}')
+            # Fetch the image the way a browser revalidates it
+            headers = {'If-None-Match': etags[question_id]} if question_id in etags else {}
+            status, _, response_headers = recorder.timed(
+                client, 'GET /chart/<id>.png', 'GET', f'/chart/{question_id}.png', headers=headers)
+            if status == 200 and response_headers.get('ETag'):
+                etags[question_id] = response_headers.get('ETag')
+            time.sleep(args.chart_interval)
+
+
+def load_in_process_app(workdir):
+    # Run against a scratch copy of the question bank so the real CSV files
+    # are left alone
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    shutil.copy(os.path.join(source_dir, 'data.csv'), os.path.join(workdir, 'data.csv'))
+    os.chdir(workdir)
+    sys.path.insert(0, source_dir)
+    import app as poll_app
+    logging.getLogger().setLevel(logging.WARNING)  # One INFO line per vote is too noisy
+    poll_app.initialize_files()
+    poll_app.start_worker()
+    return poll_app.app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate a live audience and report latency per route.')
+    parser.add_argument('--url', help='Base URL of a running server; omit to run the app in-process')
+    parser.add_argument('--participants', type=int, default=50)
+    parser.add_argument('--questions', type=int, default=5, help='Question ids 2..N+1 are activated in turn')
+    parser.add_argument('--question-seconds', type=float, default=10.0)
+    parser.add_argument('--poll-interval', type=float, default=3.0, help='Seconds between /survey polls')
+    parser.add_argument('--chart-interval', type=float, default=3.0, help='Seconds between /chart refreshes')
+    parser.add_argument('--think-time', type=float, default=2.0, help='Max seconds before answering')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args()
+
+    if args.url:
+        make_client = lambda: HttpClient(args.url)
+    else:
+        flask_app = load_in_process_app(tempfile.mkdtemp(prefix='poll-bench-'))
+        make_client = lambda: InProcessClient(flask_app)
+
+    recorder = Recorder()
+    start = time.monotonic()
+    deadline = start + args.questions * args.question_seconds
+
+    threads = [threading.Thread(target=presenter, args=(make_client(), recorder, args, deadline))]
+    for index in range(args.participants):
+        threads.append(threading.Thread(target=participant, args=(index, make_client(), recorder, args, deadline)))
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    rows = recorder.report(time.monotonic() - start)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+
+    print(f"{'route':<22}{'requests':>10}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for row in rows:
+        print(f"{row['route']:<22}{row['requests']:>10}{row['errors']:>8}{row['rps']:>9.1f}"
+              f"{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+import concurrent.futures
+import io
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import matplotlib
+import numpy as np
+from matplotlib.figure import Figure
+
+# Chart PNG rendering, kept apart from app.py so what the renderer processes
+# run does not touch the app's state. Each chart is drawn on its own Figure
+# (no pyplot state), and ChartRenderer runs the drawing in a pool of worker
+# processes so it neither holds a request thread's GIL nor waits behind other
+# charts.
+#
+# The workers are not light: multiprocessing re-runs the launching script
+# (serve.py, asgi.py or app.py) in each one as __mp_main__, so they import
+# app.py, Flask and pandas as well. That script's import only defines the
+# app; rooms, files and threads are started from its __main__ block or on the
+# first request, which never happens in a worker. Budget each worker at about
+# the memory of an idle app process.
+
+
+class ChartRenderUnavailable(Exception):
+    # The renderer queue is full, or the chart did not finish in time
+    pass
+
+
+def render_chart_png(title, labels, values):
+    # Ensure max_value is not zero before proceeding with chart generation
+    max_value = max(values) if values else 1  # Default to 1 if values are empty to avoid division by zero
+    if max_value == 0:
+        max_value = 1  # Fallback value to avoid zero division
+    # Set larger figure size and remove the border
+    fig = Figure(figsize=(10, 5))  # Increased panel size
+    ax = fig.subplots()
+
+    # Generate colors dynamically
+    colors = matplotlib.colormaps['Paired'](np.linspace(0, 1, len(labels)))
+
+    # Draw horizontal bars with a fixed panel size
+    bar_widths = [v / max_value * 0.6 for v in values]  # Scale bars dynamically
+
+    y_positions = range(len(labels))
+    ax.barh(y_positions, bar_widths, color=colors, height=0.3)
+
+    # Remove x and y axis labels and borders
+    ax.set_xticks([])
+    ax.set_yticks([])
+    ax.set_yticklabels([])
+
+    # Remove the top and left spines (borders)
+    ax.spines['top'].set_visible(False)
+    ax.spines['left'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.spines['bottom'].set_visible(False)
+
+    # Add text labels for keys and values
+    for i in range(len(labels)):
+        label = labels[i]
+        value = values[i]
+
+        # Place the key label on the left side of the bar
+        ax.text(-0.2 , i + 0.25, label, va='center', ha='left', fontsize=16, color='black', fontweight='bold')
+
+        # Place the value label on the right side of the bar
+        ax.text(bar_widths[i] + 0.02, i, str(int(value)), va='center', fontsize=18)
+
+    # Save the chart as an image without border; the question goes into the
+    # PNG metadata, as the page shows it above the image
+    img = io.BytesIO()
+    fig.savefig(img, format='png', bbox_inches='tight', pad_inches=0, metadata={'Title': title})
+    return img.getvalue()
+
+
+def init_worker():
+    # Runs once in each new worker: exit together with the app process (it
+    # may be killed without a chance to stop the pool), and load the fonts
+    # now so the first real chart does not pay for it
+    threading.Thread(target=exit_with_parent, daemon=True).start()
+    render_chart_png('', ['-'], [1])
+
+
+def exit_with_parent():
+    multiprocessing.parent_process().join()
+    os._exit(0)
+
+
+class ChartRenderer:
+    # Renders charts in `workers` processes. At most workers + queue_size
+    # charts are in flight; past that, or after `timeout` seconds, render()
+    # raises ChartRenderUnavailable instead of tying up the request thread.
+    # With workers=0 charts are drawn in the calling thread, one at a time
+    # (Matplotlib's font cache is not thread-safe).
+    def __init__(self, workers, queue_size, timeout):
+        self.workers = workers
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(workers + queue_size) if workers > 0 else None
+        self.pool = None
+        self.rejected = 0
+
+    def start(self):
+        # Create the pool in this process (after the fork, for serve.py
+        # workers). Workers are spawned as tasks arrive, so a few trivial
+        # ones bring them all up before the first chart.
+        if self.workers > 0:
+            pool = self.get_pool()
+            for _ in range(self.workers):
+                pool.submit(os.getpid)
+
+    def get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                # Spawned, not forked: the workers must not inherit the
+                # request threads' locks. A forkserver would not save the
+                # imports (see the top of this file); its children re-run
+                # __main__ too.
+                self.pool = concurrent.futures.ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context('spawn'), initializer=init_worker)
+            return self.pool
+
+    def render(self, title, labels, values):
+        if self.workers <= 0:
+            with self.lock:
+                return render_chart_png(title, labels, values)
+
+        deadline = time.monotonic() + self.timeout
+        if not self.slots.acquire(timeout=self.timeout):
+            self.rejected += 1
+            raise ChartRenderUnavailable("chart renderer queue is full")
+        pool = self.get_pool()
+        try:
+            future = pool.submit(render_chart_png, title, labels, values)
+        except BrokenProcessPool:
+            self.slots.release()
+            self.discard(pool)
+            raise ChartRenderUnavailable("chart renderer restarted")
+        # The slot is held until the worker is done, even if we stop waiting
+        future.add_done_callback(lambda _: self.slots.release())
+        try:
+            return future.result(timeout=max(deadline - time.monotonic(), 0))
+        except concurrent.futures.TimeoutError:
+            self.rejected += 1
+            raise ChartRenderUnavailable(f"chart not rendered within {self.timeout}s")
+        except BrokenProcessPool:
+            self.discard(pool)
+            raise ChartRenderUnavailable("chart renderer restarted")
+
+    def discard(self, pool):
+        # A worker died; start a fresh pool for the next chart
+        with self.lock:
+            if self.pool is pool:
+                self.pool = None
+        pool.shutdown(wait=False)
@@ -0,0 +1,94 @@
+import logging
+import os
+import signal
+import socket
+import sys
+import uuid
+
+# Production entry point: serves the app with waitress instead of Flask's
+# development server. Every open /events stream holds one of the request
+# threads, so only a few are allowed per process and the other pages fall
+# back to reloading on a timer; asgi.py (the Procfile default) streams to
+# any number of pages instead.
+#
+#   PORT                port to listen on (default 5000)
+#   WEB_THREADS         request threads per process (default 8)
+#   EVENT_STREAM_LIMIT  open /events streams per process (default a
+#                       quarter of WEB_THREADS)
+#   WEB_CONCURRENCY  worker processes (default 1). With more than one, the
+#                    workers share one listening socket and keep their
+#                    in-memory state in step through storage (POSIX only).
+
+
+def run_worker(poll_app, threads, **listen):
+    from waitress import serve
+
+    poll_app.start_worker()
+    serve(poll_app.app, threads=threads, **listen)
+
+
+def exit_worker(signum, frame):
+    # Turn SIGTERM into a normal exit so queued votes are flushed at exit;
+    # ignore repeats so they cannot interrupt that flush
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    sys.exit(0)
+
+
+def main():
+    port = int(os.environ.get("PORT", 5000))
+    threads = int(os.environ.get('WEB_THREADS', 8))
+    workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+
+    if workers > 1 and not hasattr(os, 'fork'):
+        logging.warning("WEB_CONCURRENCY > 1 needs os.fork; running a single process")
+        workers = 1
+
+    # Must be set before app is imported: one session epoch for all workers,
+    # the /events cap, and shared-state mode whenever there is more than one
+    # worker
+    os.environ.setdefault('POLL_SESSION_EPOCH', uuid.uuid4().hex[:8])
+    os.environ.setdefault('EVENT_STREAM_LIMIT', str(max(threads // 4, 1)))
+    if workers > 1:
+        os.environ['POLL_SHARED_STATE'] = '1'
+
+    import app as poll_app
+
+    # Same start-of-session reset as `python app.py`, done once before forking
+    poll_app.initialize_files()
+
+    if workers == 1:
+        run_worker(poll_app, threads, host='0.0.0.0', port=port)
+        return
+
+    listener = socket.create_server(('0.0.0.0', port), backlog=1024)
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, exit_worker)
+            try:
+                run_worker(poll_app, threads, sockets=[listener])
+            finally:
+                sys.exit(0)
+        children.append(pid)
+
+    def stop(signum, frame):
+        for child in children:
+            try:
+                os.kill(child, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for child in children:
+        while True:
+            try:
+                os.waitpid(child, 0)
+                break
+            except InterruptedError:
+                continue
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+// Browser-side version of render_chart_png() in charts.py, used when /chart is
+// in client rendering mode. Draws the same horizontal bar layout with plain
+// DOM elements: bars scaled to 60% of the width of the largest value, the
+// option label above each bar and the vote count to its right.
+(function () {
+    // Matplotlib's "Paired" colormap, sampled the way plt.cm.Paired does
+    var PAIRED = ['#a6cee3', '#1f78b4', '#b2df8a', '#33a02c', '#fb9a99', '#e31a1c',
+                  '#fdbf6f', '#ff7f00', '#cab2d6', '#6a3d9a', '#ffff99', '#b15928'];
+
+    function pairedColor(position) {
+        var index = Math.floor(position * PAIRED.length);
+        return PAIRED[Math.min(Math.max(index, 0), PAIRED.length - 1)];
+    }
+
+    // labels and values are ordered bottom to top, like the bars in app.py
+    window.renderBarChart = function (container, labels, values) {
+        var maxValue = Math.max.apply(null, values.concat([0])) || 1;
+        container.innerHTML = '';
+        container.style.width = '1000px';
+        container.style.fontFamily = 'DejaVu Sans, Arial, sans-serif';
+
+        for (var i = labels.length - 1; i >= 0; i--) {
+            var position = labels.length > 1 ? i / (labels.length - 1) : 0;
+
+            var label = document.createElement('div');
+            label.textContent = labels[i];
+            label.style.fontSize = '16px';
+            label.style.fontWeight = 'bold';
+            label.style.margin = '12px 0 4px 0';
+
+            var row = document.createElement('div');
+            row.style.display = 'flex';
+            row.style.alignItems = 'center';
+
+            var bar = document.createElement('div');
+            bar.style.width = (values[i] / maxValue * 60) + '%';
+            bar.style.height = '24px';
+            bar.style.background = pairedColor(position);
+
+            var count = document.createElement('span');
+            count.textContent = String(Math.trunc(values[i]));
+            count.style.fontSize = '18px';
+            count.style.marginLeft = '16px';
+
+            row.appendChild(bar);
+            row.appendChild(count);
+            container.appendChild(label);
+            container.appendChild(row);
+        }
+    };
+})();
@@ -0,0 +1,49 @@
+// Shared client side of /events. Pages opt in through data-* attributes on
+// <body>: data-events (the room's stream), data-active-id (reload when the
+// active question changes), data-reload-on ("user" and/or "vote"),
+// data-chart-id (which question's votes matter) and data-fallback (seconds
+// between reloads without EventSource).
+(function () {
+    var body = document.body;
+    var activeId = body.getAttribute('data-active-id');
+    var chartId = body.getAttribute('data-chart-id');
+    var reloadOn = (body.getAttribute('data-reload-on') || '').split(' ');
+    var fallback = parseInt(body.getAttribute('data-fallback') || '0', 10);
+    var pending = null;
+    function reload() {
+        // Coalesce a burst of events (a whole room voting) into one reload
+        if (!pending) {
+            pending = setTimeout(function () { location.reload(); }, 500);
+        }
+    }
+    if (!window.EventSource) {
+        if (fallback) {
+            setTimeout(function () { location.reload(); }, fallback * 1000);
+        }
+        return;
+    }
+    var source = new EventSource(body.getAttribute('data-events') || '/events');
+    source.addEventListener('error', function () {
+        // A refused stream (503 while the server is at its stream limit) is
+        // not retried by the browser, so reload on a timer instead
+        if (source.readyState === EventSource.CLOSED && fallback) {
+            setTimeout(function () { location.reload(); }, fallback * 1000);
+        }
+    });
+    source.addEventListener('active', function (e) {
+        // Also sent on every (re)connect, so a missed change is still noticed
+        if (activeId !== null && String(JSON.parse(e.data).id) !== activeId) {
+            reload();
+        }
+    });
+    if (reloadOn.indexOf('user') >= 0) {
+        source.addEventListener('user', reload);
+    }
+    if (reloadOn.indexOf('vote') >= 0) {
+        source.addEventListener('vote', function (e) {
+            if (String(JSON.parse(e.data).id) === chartId) {
+                reload();
+            }
+        });
+    }
+})();
@@ -0,0 +1,340 @@
+import argparse
+import csv
+import io
+import os
+import sqlite3
+import threading
+
+try:
+    import fcntl  # POSIX only; without it locks only cover this process
+except ImportError:
+    fcntl = None
+
+
+class FileLock:
+    # Lock shared by every process using the same side file (flock), wrapped
+    # around an ordinary thread lock for the threads of this process. The side
+    # file is reopened after a fork so parent and child never share a lock.
+    def __init__(self, path, thread_lock=None):
+        self.path = path
+        self.thread_lock = thread_lock or threading.Lock()
+        self.file = None
+        self.pid = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        if fcntl is not None:
+            if self.pid != os.getpid():
+                self.file = open(self.path, 'a')
+                self.pid = os.getpid()
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.thread_lock.release()
+
+
+def temp_path_for(path):
+    # Per-process temporary name, so two workers replacing the same file
+    # never write into each other's temporary file
+    return f"{path}.{os.getpid()}.tmp"
+
+
+class CsvStorage:
+    # The original flat files: session.csv holds one row per vote
+    # (session id, name, question id, answer), users.csv one name per login
+    # and active.csv the active question id. Every query is a full scan.
+    # With shared=True the locks also cover other processes (see FileLock).
+    def __init__(self, session_path='session.csv', users_path='users.csv', active_path='active.csv',
+                 session_lock=None, user_lock=None, active_lock=None, shared=False):
+        self.session_path = session_path
+        self.users_path = users_path
+        self.active_path = active_path
+        self.session_lock = session_lock or threading.Lock()
+        self.user_lock = user_lock or threading.Lock()
+        self.active_lock = active_lock or threading.Lock()
+        if shared:
+            self.session_lock = FileLock(session_path + '.lock', self.session_lock)
+            self.user_lock = FileLock(users_path + '.lock', self.user_lock)
+            self.active_lock = FileLock(active_path + '.lock', self.active_lock)
+
+    # Votes
+
+    def load_votes(self):
+        if not os.path.exists(self.session_path):
+            return []
+        with self.session_lock:
+            with open(self.session_path, mode='r', newline='', encoding='utf-8') as file:
+                return [row for row in csv.reader(file) if len(row) >= 4]
+
+    def append_votes(self, rows, fsync=False):
+        with self.session_lock:
+            with open(self.session_path, mode='a', newline='', encoding='utf-8') as file:
+                writer = csv.writer(file)
+                writer.writerows(rows)
+                if fsync:
+                    file.flush()
+                    os.fsync(file.fileno())
+
+    def clear_votes(self):
+        if os.path.exists(self.session_path):
+            with self.session_lock:
+                with open(self.session_path, 'w') as file:
+                    file.truncate(0)
+
+    def votes_since(self, cursor):
+        # Votes appended after byte offset cursor, the new cursor, and whether
+        # the log was truncated (in which case all rows are returned)
+        return self._rows_since(self.session_path, self.session_lock, cursor, min_columns=4)
+
+    def _rows_since(self, file_path, lock, cursor, min_columns):
+        with lock:
+            try:
+                with open(file_path, 'rb') as file:
+                    truncated = os.fstat(file.fileno()).st_size < cursor
+                    if truncated:
+                        cursor = 0
+                    file.seek(cursor)
+                    data = file.read()
+            except FileNotFoundError:
+                return [], 0, cursor > 0
+        reader = csv.reader(io.StringIO(data.decode('utf-8'), newline=''))
+        rows = [row for row in reader if len(row) >= min_columns]
+        return rows, cursor + len(data), truncated
+
+    # Users
+
+    def load_users(self):
+        if not os.path.exists(self.users_path):
+            return []
+        with self.user_lock:
+            with open(self.users_path, mode='r', newline='', encoding='utf-8') as file:
+                return [row[0] for row in csv.reader(file) if row]
+
+    def append_users(self, names, fsync=False):
+        with self.user_lock:
+            with open(self.users_path, mode='a', newline='', encoding='utf-8') as file:
+                writer = csv.writer(file)
+                writer.writerows([name] for name in names)
+                if fsync:
+                    file.flush()
+                    os.fsync(file.fileno())
+
+    def clear_users(self):
+        if os.path.exists(self.users_path):
+            with self.user_lock:
+                with open(self.users_path, 'w') as file:
+                    file.truncate(0)
+
+    def users_since(self, cursor):
+        # Same as votes_since, for users.csv; returns names
+        rows, cursor, truncated = self._rows_since(self.users_path, self.user_lock, cursor, min_columns=1)
+        return [row[0] for row in rows], cursor, truncated
+
+    # Active question
+
+    def load_active(self):
+        try:
+            with open(self.active_path, 'r') as active_file:
+                return int(active_file.read().strip())
+        except (FileNotFoundError, ValueError):
+            return 0  # Default to 0 if the file is missing or has invalid data
+
+    def store_active(self, active_id):
+        with self.active_lock:
+            self._write_active(active_id)
+
+    def _write_active(self, active_id):
+        # Replace the file in one step so a crash never leaves it empty
+        temp_path = temp_path_for(self.active_path)
+        with open(temp_path, 'w') as active_file:
+            active_file.write(str(active_id))
+        os.replace(temp_path, self.active_path)
+
+    def advance_active(self, new_active_id):
+        # Store new_active_id only if it is past the stored id; the read and
+        # the write happen under one lock
+        with self.active_lock:
+            if new_active_id <= self.load_active():
+                return False
+            self._write_active(new_active_id)
+            return True
+
+
+class SqliteStorage:
+    # Same interface as CsvStorage, backed by one SQLite database in WAL mode.
+    # Readers never block the writer, and votes_since/users_since read only the
+    # rows past a row id instead of rescanning files. Each thread gets its own
+    # connection.
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS votes (
+            id INTEGER PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            question_id INTEGER NOT NULL,
+            answer TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS active (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            question_id INTEGER NOT NULL
+        );
+        -- No query filters on these; they only slowed down inserts
+        DROP INDEX IF EXISTS votes_question_answer;
+        DROP INDEX IF EXISTS votes_session;
+        DROP INDEX IF EXISTS users_name;
+    '''
+
+    def __init__(self, db_path='poll.db', synchronous='NORMAL'):
+        self.db_path = db_path
+        self.synchronous = synchronous
+        self.local = threading.local()
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        connection.executescript(self.SCHEMA)
+        connection.close()  # Don't keep a connection that a fork could inherit
+
+    def connection(self):
+        # One connection per thread, reopened in a forked child
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(f'PRAGMA synchronous={self.synchronous}')
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    # Votes
+
+    def load_votes(self):
+        rows = self.connection().execute(
+            'SELECT session_id, name, question_id, answer FROM votes ORDER BY id')
+        return [[session_id, name, str(question_id), answer] for session_id, name, question_id, answer in rows]
+
+    def append_votes(self, rows, fsync=False):
+        # Durability follows the synchronous setting rather than fsync
+        connection = self.connection()
+        with connection:
+            connection.executemany(
+                'INSERT INTO votes (session_id, name, question_id, answer) VALUES (?, ?, ?, ?)',
+                [(row[0], row[1], int(row[2]), row[3]) for row in rows])
+
+    def clear_votes(self):
+        connection = self.connection()
+        with connection:
+            connection.execute('DELETE FROM votes')
+
+    def votes_since(self, cursor):
+        # Votes with a row id above cursor, the new cursor, and whether the
+        # table was cleared since (in which case all rows are returned)
+        connection = self.connection()
+        truncated = (connection.execute('SELECT COALESCE(MAX(id), 0) FROM votes').fetchone()[0] < cursor)
+        if truncated:
+            cursor = 0
+        rows = connection.execute(
+            'SELECT id, session_id, name, question_id, answer FROM votes WHERE id > ? ORDER BY id', (cursor,)
+        ).fetchall()
+        if rows:
+            cursor = rows[-1][0]
+        return [[session_id, name, str(question_id), answer] for _, session_id, name, question_id, answer in rows], \
+            cursor, truncated
+
+    # Users
+
+    def load_users(self):
+        return [name for (name,) in self.connection().execute('SELECT name FROM users ORDER BY id')]
+
+    def append_users(self, names, fsync=False):
+        connection = self.connection()
+        with connection:
+            connection.executemany('INSERT INTO users (name) VALUES (?)', [(name,) for name in names])
+
+    def clear_users(self):
+        connection = self.connection()
+        with connection:
+            connection.execute('DELETE FROM users')
+
+    def users_since(self, cursor):
+        connection = self.connection()
+        truncated = (connection.execute('SELECT COALESCE(MAX(id), 0) FROM users').fetchone()[0] < cursor)
+        if truncated:
+            cursor = 0
+        rows = connection.execute('SELECT id, name FROM users WHERE id > ? ORDER BY id', (cursor,)).fetchall()
+        if rows:
+            cursor = rows[-1][0]
+        return [name for _, name in rows], cursor, truncated
+
+    # Active question
+
+    def load_active(self):
+        row = self.connection().execute('SELECT question_id FROM active WHERE id = 0').fetchone()
+        return row[0] if row else 0
+
+    def store_active(self, active_id):
+        connection = self.connection()
+        with connection:
+            connection.execute('INSERT OR REPLACE INTO active (id, question_id) VALUES (0, ?)', (active_id,))
+
+    def advance_active(self, new_active_id):
+        # A single conditional UPDATE, so concurrent callers cannot go backwards
+        connection = self.connection()
+        with connection:
+            connection.execute('INSERT OR IGNORE INTO active (id, question_id) VALUES (0, 0)')
+            cursor = connection.execute(
+                'UPDATE active SET question_id = ? WHERE id = 0 AND question_id < ?',
+                (new_active_id, new_active_id))
+            return cursor.rowcount == 1
+
+    # CSV import/export
+
+    def import_csv(self, csv_storage):
+        # Replace the database contents with the CSV files
+        votes = csv_storage.load_votes()
+        users = csv_storage.load_users()
+        connection = self.connection()
+        with connection:
+            connection.execute('DELETE FROM votes')
+            connection.execute('DELETE FROM users')
+            connection.executemany(
+                'INSERT INTO votes (session_id, name, question_id, answer) VALUES (?, ?, ?, ?)',
+                [(row[0], row[1], int(row[2]), row[3]) for row in votes if row[2].strip().isdigit()])
+            connection.executemany('INSERT INTO users (name) VALUES (?)', [(name,) for name in users])
+        self.store_active(csv_storage.load_active())
+
+    def export_csv(self, csv_storage):
+        # Overwrite the CSV files with the database contents
+        csv_storage.clear_votes()
+        csv_storage.append_votes(self.load_votes())
+        csv_storage.clear_users()
+        csv_storage.append_users(self.load_users())
+        csv_storage.store_active(self.load_active())
+
+
+def open_storage(backend, db_path='poll.db', synchronous='NORMAL', **csv_options):
+    # 'csv' (the default) keeps the flat files; 'sqlite' uses db_path
+    if backend == 'sqlite':
+        return SqliteStorage(db_path, synchronous=synchronous)
+    if backend == 'csv':
+        return CsvStorage(**csv_options)
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+if __name__ == '__main__':
+    # Move poll state between the CSV files and a SQLite database, e.g.
+    #   python storage.py import --db poll.db   (CSV -> SQLite)
+    #   python storage.py export --db poll.db   (SQLite -> CSV)
+    parser = argparse.ArgumentParser(description='Import or export poll state between CSV and SQLite.')
+    parser.add_argument('command', choices=['import', 'export'])
+    parser.add_argument('--db', default=os.environ.get('POLL_DB', 'poll.db'))
+    args = parser.parse_args()
+
+    database = SqliteStorage(args.db)
+    if args.command == 'import':
+        database.import_csv(CsvStorage())
+    else:
+        database.export_csv(CsvStorage())
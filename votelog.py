@@ -0,0 +1,208 @@
+import argparse
+import json
+import os
+import threading
+
+import numpy as np
+
+from storage import CsvStorage, FileLock, temp_path_for
+
+# Compact columnar copy of a room's vote log, kept next to session.csv (or the
+# SQLite votes table). Every vote is one fixed-width record of interned ids,
+# so the whole log can be memory-mapped and every tally recomputed in one
+# vectorized pass instead of re-parsing text rows:
+#
+#   votes.bin   records of VOTE_DTYPE, appended in vote order
+#   votes.json  the string tables the ids point into, the number of valid
+#               records and the storage cursor they cover
+#
+# The text log stays the source of truth. compact() appends whatever it
+# gained since the last compaction, so a cold start only parses that tail.
+
+VOTE_DTYPE = np.dtype([('session', '<u4'), ('name', '<u4'), ('question', '<i4'), ('answer', '<u4')])
+
+
+class VoteColumns:
+    # A loaded log: the records plus the strings their ids stand for
+    def __init__(self, records, sessions, names, answers, cursor):
+        self.records = records
+        self.sessions = sessions
+        self.names = names
+        self.answers = answers
+        self.cursor = cursor
+
+    def __len__(self):
+        return len(self.records)
+
+
+class ColumnarVoteLog:
+    def __init__(self, base_path, shared=False):
+        self.records_path = base_path + '.bin'
+        self.meta_path = base_path + '.json'
+        self.lock = threading.Lock()
+        if shared:
+            self.lock = FileLock(base_path + '.lock', self.lock)
+
+    def load(self):
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as file:
+                meta = json.load(file)
+        except FileNotFoundError:
+            return VoteColumns(np.empty(0, VOTE_DTYPE), [], [], [], 0)
+        count = meta['count']
+        if count:
+            # Records past count are from an append that never got its
+            # metadata written; they are ignored and overwritten later
+            records = np.memmap(self.records_path, dtype=VOTE_DTYPE, mode='r', shape=(count,))
+        else:
+            records = np.empty(0, VOTE_DTYPE)
+        return VoteColumns(records, meta['sessions'], meta['names'], meta['answers'], meta['cursor'])
+
+    def clear(self):
+        with self.lock:
+            for path in (self.meta_path, self.records_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def compact(self, storage):
+        # Bring the log up to date with storage and return it
+        with self.lock:
+            columns = self.load()
+            rows, cursor, truncated = storage.votes_since(columns.cursor)
+            if truncated:
+                columns = VoteColumns(np.empty(0, VOTE_DTYPE), [], [], [], 0)
+            if rows or truncated or cursor != columns.cursor:
+                columns = self._append(columns, rows, cursor)
+            return columns
+
+    def _append(self, columns, rows, cursor):
+        tables = [list(columns.sessions), list(columns.names), list(columns.answers)]
+        lookups = [{value: index for index, value in enumerate(table)} for table in tables]
+
+        def intern(kind, value):
+            index = lookups[kind].get(value)
+            if index is None:
+                index = lookups[kind][value] = len(tables[kind])
+                tables[kind].append(value)
+            return index
+
+        records = []
+        for row in rows:
+            try:
+                question_id = int(row[2])
+            except ValueError:
+                continue  # Skip rows without a valid question id
+            records.append((intern(0, row[0]), intern(1, row[1]), question_id, intern(2, row[3])))
+        new_records = np.array(records, dtype=VOTE_DTYPE)
+
+        count = len(columns)
+        mode = 'r+b' if count and os.path.exists(self.records_path) else 'wb'
+        with open(self.records_path, mode) as file:
+            file.seek(count * VOTE_DTYPE.itemsize)
+            file.truncate()  # Drop records from an append that did not finish
+            file.write(new_records.tobytes())
+
+        # The records are in place before the metadata that counts them
+        meta = {'count': count + len(new_records), 'cursor': cursor,
+                'sessions': tables[0], 'names': tables[1], 'answers': tables[2]}
+        temp_path = temp_path_for(self.meta_path)
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(meta, file)
+        os.replace(temp_path, self.meta_path)
+        return self.load()
+
+
+def counted_votes(records, duplicate_policy):
+    # Indexes of the votes that count when a session may vote on a question
+    # more than once, in vote order. Matches VoteTally: 'reject' keeps each
+    # session's first vote; otherwise its last answer counts, from the first
+    # vote of the trailing run of that same answer.
+    sessions = records['session'].astype(np.int64)
+    questions = records['question'].astype(np.int64)
+    _, question_index = np.unique(questions, return_inverse=True)
+    keys = sessions * (question_index.max() + 1) + question_index
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    positions = np.arange(len(order))
+    group_start = np.ones(len(order), dtype=bool)
+    group_start[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    if duplicate_policy == 'reject':
+        return np.sort(order[group_start])
+    answers = records['answer'][order]
+    run_start = group_start.copy()
+    run_start[1:] |= answers[1:] != answers[:-1]
+    # For each position, where the run of equal answers it belongs to began
+    run_first = np.maximum.accumulate(np.where(run_start, positions, 0))
+    group_end = np.append(np.flatnonzero(group_start)[1:] - 1, len(order) - 1)
+    return np.sort(order[run_first[group_end]])
+
+
+def tally(columns, duplicate_policy='reject'):
+    # Counts per question and answer, who gave each (normalized) answer in
+    # vote order (keyed by session), and which answer each session gave to
+    # each question: the three indexes VoteTally keeps, for the whole log
+    records = columns.records
+    if not len(records):
+        return {}, {}, {}
+    records = records[counted_votes(records, duplicate_policy)]
+    questions = records['question']
+    answers = records['answer'].astype(np.int64)
+
+    # Dense question index, so bincount's output is questions x answers
+    question_ids, question_index = np.unique(questions, return_inverse=True)
+    answer_count = len(columns.answers)
+    grid = np.bincount(question_index * answer_count + answers,
+                       minlength=len(question_ids) * answer_count).reshape(len(question_ids), answer_count)
+    counts = {}
+    for row, question_id in enumerate(question_ids):
+        present = np.flatnonzero(grid[row])
+        counts[int(question_id)] = {columns.answers[a]: int(grid[row, a]) for a in present}
+
+    # Group votes by (question, normalized answer); the stable sort keeps
+    # each group in vote order
+    normalized = {}
+    normalized_ids = np.array(
+        [normalized.setdefault(answer.strip().lower(), len(normalized)) for answer in columns.answers],
+        dtype=np.int64)
+    normalized_labels = list(normalized)
+    keys = question_index * len(normalized_labels) + normalized_ids[answers]
+    order = np.argsort(keys, kind='stable')
+    boundaries = np.flatnonzero(np.diff(keys[order])) + 1
+    names = [name.strip() for name in columns.names]
+    respondents = {}
+    for group in np.split(order, boundaries):
+        key = int(keys[group[0]])
+        question_id = int(question_ids[key // len(normalized_labels)])
+        label = normalized_labels[key % len(normalized_labels)]
+        respondents.setdefault(question_id, {})[label] = {
+            columns.sessions[s]: names[n] for s, n in zip(records['session'][group], records['name'][group])}
+
+    ballots = {}
+    for session, name, question_id, answer in records.tolist():
+        ballots[(columns.sessions[session], question_id)] = (columns.answers[answer], columns.names[name])
+    return counts, respondents, ballots
+
+
+if __name__ == '__main__':
+    # Post-event analytics straight from the binary log, e.g.
+    #   python votelog.py tally                  (compacts session.csv first)
+    #   python votelog.py tally --path rooms/x/votes --csv rooms/x/session.csv
+    parser = argparse.ArgumentParser(description='Compact a vote log and print its tallies.')
+    parser.add_argument('command', choices=['compact', 'tally'])
+    parser.add_argument('--path', default='votes', help='Log path without the .bin/.json suffix')
+    parser.add_argument('--csv', default='session.csv', help='Vote log to compact from')
+    parser.add_argument('--policy', default=os.environ.get('VOTE_DUPLICATE_POLICY', 'reject'),
+                        choices=['reject', 'replace', 'count-latest'], help='Duplicate vote policy')
+    args = parser.parse_args()
+
+    vote_log = ColumnarVoteLog(args.path)
+    columns = vote_log.compact(CsvStorage(session_path=args.csv))
+    if args.command == 'compact':
+        print(f"{len(columns)} votes in {vote_log.records_path}")
+    else:
+        counts, _, _ = tally(columns, args.policy)
+        for question_id in sorted(counts):
+            for answer, votes in sorted(counts[question_id].items(), key=lambda item: -item[1]):
+                print(f"{question_id}\t{votes}\t{answer}")